@@ -23,6 +23,7 @@ import argparse
 import os
 import sys
 from lib.extract_cover_thumbs import extract_cover_thumbs
+from lib.extract_cover_thumbs import THUMBNAIL_PROFILES
 from distutils.util import strtobool
 
 parser = argparse.ArgumentParser()
@@ -44,6 +45,10 @@ parser.add_argument("-o", "--overwrite-apnx", help="overwrite APNX files",
                     action="store_true")
 parser.add_argument("--skip-apnx", help="skip generating APNX files",
                     action="store_true")
+parser.add_argument("--accurate-apnx",
+                    help="place APNX pages on lines of the decompressed "
+                    "text instead of every 2300 bytes (slower)",
+                    action="store_true")
 parser.add_argument("-f", "--fix-thumb",
                     help="fix thumbnails for PERSONAL badge",
                     action="store_true")
@@ -59,10 +64,36 @@ parser.add_argument("-l", "--lubimy-czytac",
                     help="download real pages from lubimyczytac.pl "
                     "(time-consuming process!) (only with -d)",
                     action="store_true")
+parser.add_argument("--lookup-jobs", type=int, default=4, metavar='N',
+                    help="look up N books on lubimyczytac.pl at once "
+                    "(only with -l, default: 4)")
 parser.add_argument("--mark-real-pages",
                     help="mark computed pages as real pages "
                     "(only with -l and -d)",
                     action="store_true")
+parser.add_argument("--full-scan",
+                    help="ignore the scan index and process all books; the "
+                    "index (ect_index.sqlite next to the program) tells "
+                    "devices apart by a random id kept in "
+                    "system/.ect_device_id on the Kindle",
+                    action="store_true")
+parser.add_argument("-j", "--jobs", type=int, default=1, metavar='N',
+                    help="extract covers using N processes (default: 1)")
+parser.add_argument("--read-ahead", type=int, default=4, metavar='N',
+                    help="read the next N books from the device in the "
+                    "background, 0 disables it (default: 4)")
+parser.add_argument("--resample", choices=('fast', 'balanced', 'best'),
+                    default='best',
+                    help="thumbnail resampling quality (default: best)")
+parser.add_argument("--profile", action="append", metavar='PROFILE',
+                    choices=sorted(THUMBNAIL_PROFILES),
+                    help="thumbnail profile, can be repeated to make all "
+                    "of them from one decode; only the first one is "
+                    "written to the Kindle, the others go to "
+                    "thumbnails/PROFILE next to the program, not to a "
+                    "device (choices: %s; per-model profiles such as "
+                    "Oasis or Scribe are not defined yet)" % ', '.join(
+                        sorted(THUMBNAIL_PROFILES)))
 
 if sys.platform == 'darwin':
     parser.add_argument("-e", "--eject",
@@ -93,7 +124,10 @@ if __name__ == '__main__':
                          args.overwrite_apnx, args.skip_apnx,
                          kindlepath, args.azw, args.days,
                          args.fix_thumb, args.lubimy_czytac,
-                         args.mark_real_pages, args.patch_azw3)
+                         args.mark_real_pages, args.patch_azw3,
+                         args.full_scan, args.jobs, args.read_ahead,
+                         args.resample, args.profile, args.accurate_apnx,
+                         args.lookup_jobs)
     if sys.platform == 'darwin':
         if args.eject:
             os.system('diskutil eject ' + kindlepath)
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Times building APNX files of 1k to 65k pages with the old per-page
+# string concatenation and with APNXBuilder, checking that the output
+# is identical.
+#
+# Usage: python benchmarks/bench_apnx.py
+#
+
+from __future__ import print_function
+import os
+import struct
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from lib.apnx import APNXBuilder  # noqa
+
+META = {'guid': '0123abcd', 'asin': 'B00BENCH', 'cdetype': 'EBOK',
+        'format': 'MOBI_8', 'acr': 'BENCH'}
+
+
+class Book(object):
+    def __init__(self, text_length):
+        self.text_length = text_length
+
+
+def old_pages_fast(book):
+    pages = []
+    count = 0
+    while count < book.text_length:
+        pages.append(count)
+        count += 2300
+    return pages
+
+
+def old_generate_apnx(pages, apnx_meta):
+    apnx = ''
+    content_header = '{"contentGuid":"%(guid)s","asin":"%(asin)s","cdeType":"%(cdetype)s","format":"%(format)s","fileRevisionId":"1","acr":"%(acr)s"}' % apnx_meta  # noqa
+    page_header = '{"asin":"%(asin)s","pageMap":"(1,a,1)"}' % apnx_meta
+    apnx += struct.pack('>I', 65537)
+    apnx += struct.pack('>I', 12 + len(content_header))
+    apnx += struct.pack('>I', len(content_header))
+    apnx += content_header
+    apnx += struct.pack('>H', 1)
+    apnx += struct.pack('>H', len(page_header))
+    apnx += struct.pack('>H', len(pages))
+    apnx += struct.pack('>H', 32)
+    apnx += page_header
+    for page in pages:
+        apnx += struct.pack('>I', page)
+    return apnx
+
+
+def main():
+    builder = APNXBuilder()
+    for count in (1000, 4000, 16000, 65000):
+        book = Book(count * 2300)
+
+        def old():
+            return old_generate_apnx(old_pages_fast(book), META)
+
+        def new():
+            return builder.generate_apnx(builder.get_pages_fast(book), META)
+
+        if old() != new():
+            sys.exit('%d pages: output differs!' % count)
+        repeat = 5
+        t_old = min(timeit.repeat(old, number=1, repeat=repeat))
+        t_new = min(timeit.repeat(new, number=1, repeat=repeat))
+        print('%6d pages: %8.2f ms -> %6.2f ms (%.1fx)' % (
+            count, t_old * 1000, t_new * 1000, t_old / t_new))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Compares the time needed to turn a cover into a thumbnail with
+# a full-resolution RGB decode (the old way) and with reduced-scale
+# grayscale decoding, for every resampling tier, and making thumbnails for
+# all profiles from separate decodes and from a single one.
+#
+# Usage: python benchmarks/bench_covers.py [cover.jpg ...]
+#
+
+from __future__ import print_function
+import os
+import sys
+import timeit
+
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from PIL import Image  # noqa
+from lib.extract_cover_thumbs import RESAMPLE_FILTERS  # noqa
+from lib.extract_cover_thumbs import THUMBNAIL_PROFILES  # noqa
+from lib.extract_cover_thumbs import process_image  # noqa
+
+
+def full_decode(data):
+    cover = Image.open(BytesIO(data))
+    cover.load()
+    cover = cover.resize(cover.size)
+    cover.thumbnail((305, 470), Image.ANTIALIAS)
+    return cover.convert('L')
+
+
+def sample_cover(size=(1600, 2560)):
+    cover = Image.linear_gradient('L').convert('RGB').resize(size)
+    data = BytesIO()
+    cover.save(data, 'JPEG', quality=90)
+    return data.getvalue()
+
+
+def bench(label, func, repeat):
+    best = min(timeit.repeat(func, number=1, repeat=repeat))
+    print('  %-22s %8.2f ms' % (label, best * 1000))
+    return best
+
+
+def main():
+    covers = [(path, open(path, 'rb').read()) for path in sys.argv[1:]]
+    if not covers:
+        covers = [('1600x2560 synthetic', sample_cover())]
+    repeat = 10
+    default = THUMBNAIL_PROFILES['default']
+    profiles = [THUMBNAIL_PROFILES[name]
+                for name in sorted(THUMBNAIL_PROFILES)]
+    for label, data in covers:
+        print(label)
+        base = bench('full decode, best', lambda: full_decode(data), repeat)
+        for tier in sorted(RESAMPLE_FILTERS):
+            t = bench('draft, %s' % tier, lambda: process_image(
+                data, [default], 'EBOK', False, tier), repeat)
+            print('  %-22s %8.1fx' % ('', base / t))
+        separate = bench('%d profiles, separate' % len(profiles),
+                         lambda: [process_image(data, [profile], 'PDOC',
+                                                False)
+                                  for profile in profiles], repeat)
+        shared = bench('%d profiles, shared' % len(profiles),
+                       lambda: process_image(data, profiles, 'PDOC', False),
+                       repeat)
+        print('  %-22s %8.1fx' % ('', separate / shared))
+
+
+if __name__ == '__main__':
+    main()
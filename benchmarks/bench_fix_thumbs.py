@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Times the --overwrite-pdoc-thumbs pass over 2000 thumbnails generated
+# by the Kindle and already fixed, when the density is read by opening
+# every thumbnail with Pillow and when it is read from the JPEG headers
+# by fix_generated_thumbs().
+#
+# Usage: python benchmarks/bench_fix_thumbs.py
+#
+
+from __future__ import print_function
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from PIL import Image  # noqa
+from lib.extract_cover_thumbs import fix_generated_thumbs  # noqa
+from lib.jpeg_density import jpeg_dpi  # noqa
+from lib.thumbnail_index import ThumbnailIndex  # noqa
+from lib.thumbnail_index import thumbnail_name  # noqa
+
+THUMBNAILS = 2000
+
+
+def make_device(kindle):
+    thumb_dir = os.path.join(kindle, 'system', 'thumbnails')
+    os.makedirs(thumb_dir)
+    cover = Image.new('L', (330, 470), 'gray')
+    for i in range(THUMBNAILS):
+        cover.save(os.path.join(thumb_dir, thumbnail_name(
+            'B%07d' % i, 'PDOC', 'landscape')), dpi=[72, 72])
+    return thumb_dir
+
+
+def main():
+    tempdir = tempfile.mkdtemp()
+    thumb_dir = make_device(tempdir)
+    paths = ThumbnailIndex(thumb_dir).paths()
+
+    def pillow():
+        return [tuple(Image.open(path).info['dpi']) for path in paths]
+
+    def header():
+        return [jpeg_dpi(path) for path in paths]
+
+    def fix_pass():
+        for path in paths:
+            fix_generated_thumbs(path, False, True)
+
+    try:
+        if pillow() != header():
+            sys.exit('densities differ!')
+        t_pillow = min(timeit.repeat(pillow, number=1, repeat=5))
+        t_header = min(timeit.repeat(header, number=1, repeat=5))
+        t_fix = min(timeit.repeat(fix_pass, number=1, repeat=5))
+    finally:
+        shutil.rmtree(tempdir)
+    print('Pillow %.1f ms, headers %.1f ms, fix pass %.1f ms' % (
+        t_pillow * 1000, t_header * 1000, t_fix * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Compares the reference PackedIon decoder with IonDecoder on KFX
+# containers, KDF databases and raw ION files, checking that both give
+# identical output.
+#
+# Usage: python benchmarks/bench_ion.py [book.kfx|book.kdf|file.ion ...]
+#
+# Without arguments a synthetic container with 5000 entities is used.
+#
+
+from __future__ import print_function
+import os
+import sqlite3
+import struct
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from lib import kfxmeta  # noqa
+
+
+def varuint(n):
+    out = chr(n & 0x7f | 0x80)
+    n >>= 7
+    while n:
+        out = chr(n & 0x7f) + out
+        n >>= 7
+    return out
+
+
+def typed(data_type, payload):
+    if len(payload) < 14:
+        return chr(data_type << 4 | len(payload)) + payload
+    return chr(data_type << 4 | 14) + varuint(len(payload)) + payload
+
+
+def uint(n):
+    out = ''
+    while n:
+        out = chr(n & 0xff) + out
+        n >>= 8
+    return out
+
+
+def ion_struct(*fields):
+    return typed(kfxmeta.DT_STRUCT, ''.join(
+        varuint(symbol) + value for symbol, value in fields))
+
+
+def ion_list(*values):
+    return typed(kfxmeta.DT_LIST, ''.join(values))
+
+
+def ion_string(text):
+    return typed(kfxmeta.DT_STRING, text.encode('utf8'))
+
+
+def sample_entity(n):
+    words = [ion_string(u'słowo %d' % (n * 40 + i)) for i in range(40)]
+    return kfxmeta.ION_MAGIC + ion_struct(
+        (153, ion_string(u'Rozdział %d' % n)),
+        (165, typed(kfxmeta.DT_SYMBOL, uint(850 + n % 4))),
+        (8, typed(kfxmeta.DT_POSITIVE_INTEGER, uint(n * 7919 + 1))),
+        (10, typed(kfxmeta.DT_NEGATIVE_INTEGER, uint(n * 31 + 70000))),
+        (7, ion_list(*words)),
+        (222, typed(kfxmeta.DT_FLOAT, struct.pack('>d', n / 3.0))),
+        (224, typed(kfxmeta.DT_DECIMAL, '\xc2' + uint(n % 100 + 1))),
+        (232, typed(kfxmeta.DT_BLOB, os.urandom(64))),
+        (251, typed(kfxmeta.DT_S_EXPRESSION, ion_string(u'x') +
+                    typed(kfxmeta.DT_BOOLEAN, '\x01'[:n % 2]))),
+    )
+
+
+def sample_container(count=5000):
+    entities = ''
+    index = ''
+    for n in range(count):
+        entity = kfxmeta.ENTITY_MAGIC + struct.pack('<HL', 1, 10) + \
+            sample_entity(n)
+        index += struct.pack('<LLQQ', 1000 + n, 259, len(entities),
+                             len(entity))
+        entities += entity
+
+    def info(index_offset):
+        return kfxmeta.ION_MAGIC + ion_struct(
+            (413, typed(2, struct.pack('>L', index_offset))),
+            (414, typed(2, struct.pack('>L', len(index)))))
+    index_offset = 18 + len(info(0))
+    header = kfxmeta.CONTAINER_MAGIC + struct.pack(
+        '<HLLL', 2, index_offset + len(index), 18, len(info(0)))
+    return header + info(index_offset) + index + entities
+
+
+def payloads(path, data):
+    if path.endswith('.kdf'):
+        conn = sqlite3.connect(path)
+        rows = conn.execute('SELECT id, payload_value FROM fragments '
+                            'WHERE payload_type = "blob" AND id != "max_id"')
+        result = [str(payload) for _id, payload in rows]
+        conn.close()
+        return result
+    if data[0:4] == kfxmeta.CONTAINER_MAGIC:
+        container = kfxmeta.KFXContainer(data)
+        result = []
+        for i in range(container.entity_count):
+            entity = container.entity(i)
+            if entity.entity_data[0:4] == kfxmeta.ION_MAGIC:
+                result.append(str(entity.entity_data))
+        return result
+    return [data]
+
+
+def bench(label, decoder, items):
+    start = time.time()
+    values = [decoder(item).decode() if item[0:4] == kfxmeta.ION_MAGIC
+              else None for item in items]
+    elapsed = time.time() - start
+    print('  %-12s %8.1f ms' % (label, elapsed * 1000))
+    return elapsed, values
+
+
+def main():
+    sources = [(path, kfxmeta.read_file(path)) for path in sys.argv[1:]]
+    if not sources:
+        sources = [('5000 synthetic entities', sample_container())]
+    for path, data in sources:
+        items = payloads(path, data)
+        print('%s: %d ION values, %d B' % (path, len(items),
+                                          sum(len(i) for i in items)))
+        reference, expected = bench('PackedIon', kfxmeta.PackedIon, items)
+        fast, values = bench('IonDecoder', kfxmeta.IonDecoder, items)
+        bench('  unordered', lambda item: kfxmeta.IonDecoder(
+            item, ordered=False), items)
+        if kfxmeta.json_dump(values) != kfxmeta.json_dump(expected):
+            sys.exit('  output differs!')
+        print('  %-12s %8.1fx, identical output' % ('', reference / fast))
+
+
+if __name__ == '__main__':
+    main()
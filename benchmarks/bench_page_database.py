@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Times page count lookups and appends for 1000 books against an ect.csv
+# of 20k rows, scanning the file for every book as before and with the
+# indexed PageDatabase.
+#
+# Usage: python benchmarks/bench_page_database.py
+#
+
+from __future__ import print_function
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from lib.page_database import CSV_HEADER  # noqa
+from lib.page_database import PageDatabase  # noqa
+from lib.page_database import csv_reader  # noqa
+from lib.page_database import csv_writer  # noqa
+
+ROWS = 20000
+BOOKS = 1000
+
+
+def row(i):
+    return ['B%08d' % i, 'pl', 'Autor %d' % i, 'Tytul %d' % i,
+            str(100 + i % 500), 'False', 'book%d.mobi' % i]
+
+
+def old_run(filename, books):
+    # asin_list_from_csv(), dump_pages() and the generate_apnx_files() scan
+    with open(filename) as f:
+        asinlist = []
+        filelist = []
+        for r in csv_reader(f):
+            asinlist.append(r[0])
+            filelist.append(r[6])
+    for r in books:
+        if r[0] in asinlist or r[6] in filelist:
+            continue
+        with open(filename, 'ab') as o:
+            csv_writer(o).writerow(r)
+    found = 0
+    for r in books:
+        with open(filename, 'rb') as f:
+            for i in csv_reader(f):
+                if i[0] == r[0]:
+                    found += 1
+    return found
+
+
+def new_run(filename, books):
+    pagedb = PageDatabase(filename)
+    for r in books:
+        pagedb.add(r)
+    pagedb.flush()
+    return sum(1 for r in books if pagedb.find(r[0], r[6]) is not None)
+
+
+def main():
+    tempdir = tempfile.mkdtemp()
+    filename = os.path.join(tempdir, 'ect.csv')
+    # half of the books are already known, the other half is new
+    books = [row(i) for i in range(ROWS - BOOKS // 2, ROWS + BOOKS // 2)]
+
+    def reset():
+        with open(filename, 'wb') as f:
+            csv_writer(f).writerows([CSV_HEADER] + [
+                row(i) for i in range(ROWS)])
+
+    def old():
+        reset()
+        return old_run(filename, books)
+
+    def new():
+        reset()
+        return new_run(filename, books)
+
+    # PageDatabase.add() reports every new row
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        same = old() == new()
+        t_old = min(timeit.repeat(old, number=1, repeat=3))
+        t_new = min(timeit.repeat(new, number=1, repeat=3))
+    finally:
+        sys.stdout = stdout
+        shutil.rmtree(tempdir)
+    if not same:
+        sys.exit('lookups differ!')
+    print('%d rows, %d books: %.2f s -> %.3f s (%.0fx)' % (
+        ROWS, BOOKS, t_old, t_new, t_old / t_new))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Times writing APNX files for the given MOBI/AZW3 books with the fast
+# and the accurate algorithm, opening each book from scratch as the
+# APNX stage does, and reports the text decompression rate.
+#
+# Usage: python benchmarks/bench_pagination.py BOOK [BOOK...]
+#
+
+from __future__ import print_function
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from lib.apnx import APNXBuilder  # noqa
+from lib.mobi_book import MobiBook  # noqa
+
+
+def main():
+    if len(sys.argv) < 2:
+        sys.exit('Usage: bench_pagination.py BOOK [BOOK...]')
+    builder = APNXBuilder()
+    tempdir = tempfile.mkdtemp()
+    apnx_path = os.path.join(tempdir, 'bench.apnx')
+    total_fast = total_accurate = 0
+    try:
+        for path in sys.argv[1:]:
+            def fast():
+                builder.write_apnx(path, apnx_path)
+
+            def accurate():
+                builder.write_apnx(path, apnx_path, accurate=True)
+
+            def decompress():
+                return sum(len(r) for r in MobiBook(path).text_records())
+
+            text_length = decompress()
+            repeat = 3
+            t_fast = min(timeit.repeat(fast, number=1, repeat=repeat))
+            t_accurate = min(timeit.repeat(accurate, number=1,
+                                           repeat=repeat))
+            t_text = min(timeit.repeat(decompress, number=1, repeat=repeat))
+            total_fast += t_fast
+            total_accurate += t_accurate
+            print('%s: %d pages fast, %d accurate' % (
+                os.path.basename(path),
+                len(builder.get_pages_fast(MobiBook(path))),
+                len(builder.get_pages_accurate(MobiBook(path)))))
+            print('  fast %.2f ms, accurate %.2f ms (%.1fx), '
+                  'decompression %.1f MB/s' % (
+                      t_fast * 1000, t_accurate * 1000, t_accurate / t_fast,
+                      text_length / t_text / 1e6))
+    finally:
+        shutil.rmtree(tempdir)
+    print('total: fast %.2f ms, accurate %.2f ms (%.1fx)' % (
+        total_fast * 1000, total_accurate * 1000,
+        total_accurate / total_fast))
+
+
+if __name__ == '__main__':
+    main()
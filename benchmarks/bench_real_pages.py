@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Times real page lookups for 60 books against a local stand-in for
+# lubimyczytac.pl that answers every request after 50 ms, one book at
+# a time and with 8 lookups at once, and counts the connections made.
+# Every 10th request fails with 503 once to exercise the retries and
+# every 7th book is not found. The last two runs use a LookupCache,
+# first empty and then filled by the run before.
+#
+# Usage: python benchmarks/bench_real_pages.py
+#
+
+from __future__ import print_function
+import BaseHTTPServer
+import os
+import shutil
+import SocketServer
+import sys
+import tempfile
+import threading
+import time
+import urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from lib.get_real_pages import get_real_pages  # noqa
+from lib.http_client import HTTPClient  # noqa
+from lib.lookup_cache import LookupCache  # noqa
+from lib.page_database import CSV_HEADER  # noqa
+from lib.page_database import PageDatabase  # noqa
+from lib.page_database import csv_writer  # noqa
+
+BOOKS = 60
+LATENCY = 0.05
+
+NO_RESULTS = '''<html><body><div class="results"></div></body></html>'''
+SEARCH_PAGE = '''<html><body><div class="results">
+<div class="book-data"><div class="book-general-data">
+<a class="bookTitle" href="/ksiazka/%(id)s/tytul">Tytul %(id)s</a>
+<a href="/autor/1/autor">Autor %(id)s</a>
+</div></div></div></body></html>'''
+BOOK_PAGE = '''<html><body><div class="profil-desc-inline"><dl>
+<dt>liczba stron</dt><dd>%(pages)s</dd></dl></div></body></html>'''
+
+
+class StandIn(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    requests = 0
+    connections = 0
+    lock = threading.Lock()
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        with StandIn.lock:
+            StandIn.connections += 1
+
+    def do_GET(self):
+        with StandIn.lock:
+            StandIn.requests += 1
+            fail = StandIn.requests % 10 == 0
+        time.sleep(LATENCY)
+        url = urlparse.urlsplit(self.path)
+        if fail:
+            body, status = 'busy', 503
+        elif url.path == '/szukaj/ksiazki':
+            book = urlparse.parse_qs(url.query)['phrase'][0].split()[-1]
+            if int(book) % 7 == 0:
+                body, status = NO_RESULTS, 200
+            else:
+                body, status = SEARCH_PAGE % {'id': book}, 200
+        elif url.path.startswith('/ksiazka/'):
+            book = int(url.path.split('/')[2])
+            body, status = BOOK_PAGE % {'pages': 100 + book}, 200
+        else:
+            body, status = 'not found', 404
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+def run(filename, base_url, jobs, cache=None):
+    with open(filename, 'wb') as f:
+        csv_writer(f).writerows([CSV_HEADER] + [
+            ['B%d' % i, 'pl', 'Autor %d' % i, 'Tytul %d' % i, '1', 'False',
+             'book%d.mobi' % i] for i in range(BOOKS)])
+    pagedb = PageDatabase(filename)
+    StandIn.requests = StandIn.connections = 0
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    start = time.time()
+    try:
+        # no rate limit and a short backoff for the retried requests
+        get_real_pages(pagedb, False, jobs, base_url, pagedb.flush,
+                       HTTPClient(backoff=0.05), cache)
+    finally:
+        sys.stdout = stdout
+    elapsed = time.time() - start
+    found = sum(1 for i in range(BOOKS)
+                if pagedb.find('B%d' % i, '')[4] == str(100 + i))
+    print('%d jobs%s: %.2f s, %d/%d books, %d requests, %d connections' % (
+        jobs, ', cached' if cache is not None else '', elapsed, found,
+        BOOKS, StandIn.requests, StandIn.connections))
+
+
+def main():
+    server = Server(('127.0.0.1', 0), StandIn)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    base_url = 'http://127.0.0.1:%d' % server.server_address[1]
+    tempdir = tempfile.mkdtemp()
+    try:
+        for jobs in (1, 8):
+            run(os.path.join(tempdir, 'ect.csv'), base_url, jobs)
+        cache = LookupCache(os.path.join(tempdir, 'lookups.sqlite'))
+        for _ in range(2):
+            run(os.path.join(tempdir, 'ect.csv'), base_url, 8, cache)
+        cache.close()
+    finally:
+        server.shutdown()
+        shutil.rmtree(tempdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Times finding the books changed in the last 7 days in a documents
+# tree of 2000 books with .sdr sidecars and a dictionaries directory,
+# walking it twice with os.walk and date strings as the cover and APNX
+# stages did, and once with scan_library().
+#
+# Usage: python benchmarks/bench_scan.py [DOCUMENTS]
+#
+
+from __future__ import print_function
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from lib.library_scan import BOOK_EXTENSIONS  # noqa
+from lib.library_scan import days_cutoff  # noqa
+from lib.library_scan import scan_library  # noqa
+from lib.library_scan import scandir  # noqa
+
+BOOKS = 2000
+DAYS = '7'
+
+
+def make_tree(docs):
+    for d in range(BOOKS // 100):
+        folder = os.path.join(docs, 'folder%d' % d)
+        os.makedirs(folder)
+        for i in range(100):
+            name = 'book%d' % i
+            open(os.path.join(folder, name + '.mobi'), 'wb').close()
+            sdr = os.path.join(folder, name + '.sdr')
+            os.makedirs(sdr)
+            for ext in ('.apnx', '.mbp1', '.mbs', '.azw3f', '.azw3r'):
+                open(os.path.join(sdr, name + ext), 'wb').close()
+    dictionaries = os.path.join(docs, 'dictionaries')
+    os.makedirs(dictionaries)
+    for i in range(20):
+        open(os.path.join(dictionaries, 'dict%d.azw' % i), 'wb').close()
+
+
+def old_walk(docs, skip_dictionaries):
+    dtt = datetime.today()
+    days_int = int(DAYS)
+    found = []
+    for root, dirs, files in os.walk(docs):
+        for name in files:
+            if skip_dictionaries and (
+                    'documents' + os.path.sep + 'dictionaries' in root):
+                continue
+            try:
+                dt = os.path.getctime(os.path.join(root, name))
+            except OSError:
+                continue
+            dt = datetime.fromtimestamp(dt).strftime('%Y-%m-%d')
+            dt = datetime.strptime(dt, '%Y-%m-%d')
+            diff = (dtt - dt).days
+            if name.lower().endswith(BOOK_EXTENSIONS) and diff <= days_int:
+                found.append(os.path.join(root, name))
+    return found
+
+
+def main():
+    tempdir = None
+    if len(sys.argv) > 1:
+        docs = sys.argv[1]
+    else:
+        tempdir = tempfile.mkdtemp()
+        docs = os.path.join(tempdir, 'documents')
+        make_tree(docs)
+
+    def old():
+        # the cover stage, then the APNX stage
+        old_walk(docs, False)
+        return old_walk(docs, True)
+
+    def new():
+        return [book.path for book in scan_library(
+            docs, cutoff=days_cutoff(DAYS))]
+
+    try:
+        if old() != new():
+            sys.exit('books found differ!')
+        t_old = min(timeit.repeat(old, number=1, repeat=5))
+        t_new = min(timeit.repeat(new, number=1, repeat=5))
+    finally:
+        if tempdir is not None:
+            shutil.rmtree(tempdir)
+    print('%s: %.1f ms -> %.1f ms (%.1fx)' % (
+        'scandir' if scandir is not None else 'listdir',
+        t_old * 1000, t_new * 1000, t_old / t_new))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Times the thumbnail checks of a run over a device with 2000 books and
+# 3000 thumbnails: an isfile() per book in the skip check and again in
+# the cover stage, a listdir for the --overwrite-pdoc-thumbs pass and
+# the .partial cleanup walking the whole device, against one
+# ThumbnailIndex shared by all of them.
+#
+# Usage: python benchmarks/bench_thumbnails.py
+#
+
+from __future__ import print_function
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from lib.thumbnail_index import ThumbnailIndex  # noqa
+from lib.thumbnail_index import thumbnail_name  # noqa
+
+BOOKS = 2000
+THUMBNAILS = 3000
+
+
+def make_device(kindle):
+    thumb_dir = os.path.join(kindle, 'system', 'thumbnails')
+    os.makedirs(thumb_dir)
+    for i in range(THUMBNAILS):
+        orientation = 'portrait' if i % 3 else 'landscape'
+        open(os.path.join(thumb_dir, thumbnail_name(
+            'B%07d' % i, 'EBOK', orientation)), 'wb').close()
+    for d in range(BOOKS // 100):
+        folder = os.path.join(kindle, 'documents', 'folder%d' % d)
+        os.makedirs(folder)
+        for i in range(100):
+            sdr = os.path.join(folder, 'book%d.sdr' % i)
+            os.makedirs(sdr)
+            for ext in ('.mobi', '.apnx', '.mbp1'):
+                open(os.path.join(sdr, 'book%d%s' % (i, ext)), 'wb').close()
+    return thumb_dir
+
+
+def main():
+    tempdir = tempfile.mkdtemp()
+    thumb_dir = make_device(tempdir)
+    asins = ['B%07d' % (i * 2) for i in range(BOOKS)]
+
+    def old():
+        found = 0
+        for _ in range(2):
+            found = sum(1 for asin in asins if os.path.isfile(os.path.join(
+                thumb_dir, thumbnail_name(asin, 'EBOK'))))
+        fixed = [name for name in os.listdir(thumb_dir)
+                 if not name.endswith('portrait.jpg')]
+        for root, dirs, files in os.walk(tempdir):
+            [name for name in files if name.endswith('.partial')]
+        return found, len(fixed)
+
+    def new():
+        thumbs = ThumbnailIndex(thumb_dir)
+        for _ in range(2):
+            found = sum(1 for asin in asins if thumbs.has(asin, 'EBOK'))
+        fixed = thumbs.paths(exclude_orientation='portrait')
+        thumbs.remove_partial()
+        return found, len(fixed)
+
+    try:
+        if old() != new():
+            sys.exit('results differ!')
+        t_old = min(timeit.repeat(old, number=1, repeat=5))
+        t_new = min(timeit.repeat(new, number=1, repeat=5))
+    finally:
+        shutil.rmtree(tempdir)
+    print('%.1f ms -> %.1f ms (%.1fx)' % (
+        t_old * 1000, t_new * 1000, t_old / t_new))
+
+
+if __name__ == '__main__':
+    main()
@@ -8,74 +8,79 @@ __docformat__ = 'restructuredtext en'
 Generates and writes an APNX page mapping file.
 '''
 
+import re
 import struct
 import os
 import sys
 
-import kindle_unpack
-from lib.header import PdbHeaderReader
+from lib.mobi_book import MobiBook
+
+
+# opening tags that start a new line, mbp:pagebreak starts a new page
+BLOCK_TAGS = re.compile(
+    r'<(p|div|h[1-6]|li|blockquote|br|mbp:pagebreak)(?=[\s/>])', re.I)
+TAGS = re.compile(r'<[^>]*>')
+CHARS_PER_LINE = 70
+LINES_PER_PAGE = 32
 
 
 class APNXBuilder(object):
     """Create an APNX file using a pseudo page mapping."""
 
-    def write_apnx(self, mobi_file_path, apnx_path, page_count=0):
+    def write_apnx(self, mobi_file_path, apnx_path, page_count=0, book=None,
+                   accurate=False):
         """
         Write APNX file.
 
         If you want a fixed number of pages (such as from a custom column) then
         pass in a value to page_count, otherwise a count will be estimated
-        using either the fast or accurate algorithm.
+        using either the fast or, with accurate set, the accurate algorithm.
+
+        An already loaded MobiBook can be passed in as book so the file is
+        not read again.
         """
         import uuid
         apnx_meta = {'guid': str(uuid.uuid4()).replace('-', '')[:8], 'asin':
                      '', 'cdetype': 'EBOK', 'format': 'MOBI_7', 'acr': ''}
 
-        try:
-            with open(mobi_file_path, 'rb') as mf:
-                ident = PdbHeaderReader(mf).identity()
-                if ident != 'BOOKMOBI':
-                    # Check that this is really a MOBI file.
-                    print('BŁĄD! Niepoprawny plik MOBI "%s"'
-                          % os.path.basename(mobi_file_path))
-                    return 1
-                apnx_meta['acr'] = str(PdbHeaderReader(mf).name())
-        except:
-            print('Błąd! Nie można otworzyć pliku %s' % mobi_file_path)
-            return 1
-        with open(mobi_file_path, 'rb') as mf:
-            section = kindle_unpack.Sectionizer(mobi_file_path)
-            mhlst = [kindle_unpack.MobiHeader(section, 0)]
-            mh = mhlst[0]
-            metadata = mh.getmetadata()
-            if mh.version == 8:
-                apnx_meta['format'] = 'MOBI_8'
-            else:
-                apnx_meta['format'] = 'MOBI_7'
+        if book is None:
             try:
-                if metadata['Document Type'][0] is None:
-                    apnx_meta['cdetype'] = 'EBOK'
-                else:
-                    apnx_meta['cdetype'] = 'EBOK'
-                    apnx_meta['cdetype'] = metadata['Document Type'][0]
-            except KeyError:
-                apnx_meta['cdetype'] = 'EBOK'
-            try:
-                if metadata['ASIN'][0] is None:
-                    apnx_meta['asin'] = ''
-                else:
-                    apnx_meta['asin'] = metadata['ASIN'][0]
-            except KeyError:
-                apnx_meta['asin'] = ''
+                book = MobiBook(mobi_file_path)
+            except:
+                print('Błąd! Nie można otworzyć pliku %s' % mobi_file_path)
+                return 1
+        if not book.is_mobi():
+            # Check that this is really a MOBI file.
+            print('BŁĄD! Niepoprawny plik MOBI "%s"'
+                  % os.path.basename(mobi_file_path))
+            return 1
+        apnx_meta['acr'] = book.acr
+        if book.version == 8:
+            apnx_meta['format'] = 'MOBI_8'
+        else:
+            apnx_meta['format'] = 'MOBI_7'
+        if book.doctype is None:
+            apnx_meta['cdetype'] = 'EBOK'
+        else:
+            apnx_meta['cdetype'] = book.doctype
+        if book.asin is None:
+            apnx_meta['asin'] = ''
+        else:
+            apnx_meta['asin'] = book.asin
 
-        pages = []
         if page_count:
-            pages = self.get_pages_exact(mobi_file_path, page_count)
+            pages = self.get_pages_exact(book, page_count)
+        elif accurate:
+            try:
+                pages = self.get_pages_accurate(book)
+            except Exception:
+                # encrypted or damaged text, fall back to the fast algorithm
+                pages = []
         else:
-            pages = self.get_pages_fast(mobi_file_path)
+            pages = self.get_pages_fast(book)
 
         if not pages:
-            pages = self.get_pages_fast(mobi_file_path)
+            pages = self.get_pages_fast(book)
         if not pages:
             print('Nie można wygenerować mapowania stron.')
         if len(pages) > 65536:
@@ -91,30 +96,23 @@ class APNXBuilder(object):
             apnxf.write(apnx)
 
     def generate_apnx(self, pages, apnx_meta):
-        apnx = ''
-
         if apnx_meta['format'] == 'MOBI_8':
             content_header = '{"contentGuid":"%(guid)s","asin":"%(asin)s","cdeType":"%(cdetype)s","format":"%(format)s","fileRevisionId":"1","acr":"%(acr)s"}' % apnx_meta  # noqa
         else:
             content_header = '{"contentGuid":"%(guid)s","asin":"%(asin)s","cdeType":"%(cdetype)s","fileRevisionId":"1"}' % apnx_meta  # noqa
         page_header = '{"asin":"%(asin)s","pageMap":"(1,a,1)"}' % apnx_meta
 
-        apnx += struct.pack('>I', 65537)
-        apnx += struct.pack('>I', 12 + len(content_header))
-        apnx += struct.pack('>I', len(content_header))
-        apnx += content_header
-        apnx += struct.pack('>H', 1)
-        apnx += struct.pack('>H', len(page_header))
-        apnx += struct.pack('>H', len(pages))
-        apnx += struct.pack('>H', 32)
-        apnx += page_header
-
-        for page in pages:
-            apnx += struct.pack('>I', page)
-
-        return apnx
-
-    def get_pages_exact(self, mobi_file_path, page_count):
+        # the whole page table is packed in one go
+        return ''.join([
+            struct.pack('>III', 65537, 12 + len(content_header),
+                        len(content_header)),
+            content_header,
+            struct.pack('>HHHH', 1, len(page_header), len(pages), 32),
+            page_header,
+            struct.pack('>%dI' % len(pages), *pages),
+        ])
+
+    def get_pages_exact(self, book, page_count):
         """
         Get pages exact.
 
@@ -122,25 +120,13 @@ class APNXBuilder(object):
         create our array of pages for the apnx file by dividing by
         the content size of the book.
         """
-        pages = []
-        count = 0
-
-        with open(mobi_file_path, 'rb') as mf:
-            phead = PdbHeaderReader(mf)
-            r0 = phead.section_data(0)
-            text_length = struct.unpack('>I', r0[4:8])[0]
-
-        chars_per_page = int(text_length / page_count)
-        while count < text_length:
-            pages.append(count)
-            count += chars_per_page
-
-        if len(pages) > page_count:
-            pages = pages[:page_count]
+        text_length = book.text_length
 
-        return pages
+        chars_per_page = max(int(text_length / page_count), 1)
+        return xrange(0, min(text_length, chars_per_page * page_count),
+                      chars_per_page)
 
-    def get_pages_fast(self, mobi_file_path):
+    def get_pages_fast(self, book):
         """
         2300 characters of uncompressed text per page.
 
@@ -157,17 +143,77 @@ class APNXBuilder(object):
         It's faster to work off of the length then to
         decompress and parse the actual text.
         """
-        text_length = 0
-        pages = []
-        count = 0
-
-        with open(mobi_file_path, 'rb') as mf:
-            phead = PdbHeaderReader(mf)
-            r0 = phead.section_data(0)
-            text_length = struct.unpack('>I', r0[4:8])[0]
+        return xrange(0, book.text_length, 2300)
 
-        while count < text_length:
-            pages.append(count)
-            count += 2300
-
-        return pages
+    def get_pages_accurate(self, book):
+        """
+        Pages made of lines of the actual text.
+
+        A line starts with every paragraph (or other block) holding text
+        and again every 70 characters of text inside it, a page is 32
+        lines and an mbp:pagebreak always starts a new page, so pages
+        begin where a line does rather than in the middle of a tag. The
+        text records are decompressed and walked one at a time, so only
+        the page offsets are kept in memory.
+        """
+        if book.mh.crypto_type:
+            return []
+        pages = []
+        state = {'lines': 0, 'chars': None, 'pending': None}
+
+        def new_lines(offsets):
+            for offset in offsets:
+                if state['lines'] % LINES_PER_PAGE == 0:
+                    pages.append(offset)
+                state['lines'] += 1
+
+        def text(data, start, end, base):
+            if start >= end:
+                return
+            chars = state['chars']
+            if state['pending'] is not None:
+                if not data[start:end].strip():
+                    return
+                new_lines((state['pending'],))
+                state['pending'] = None
+                chars = 0
+            elif chars is None:
+                # text outside of any block, such as the head
+                return
+            chars += end - start
+            if chars > CHARS_PER_LINE:
+                first = base + end - (chars - CHARS_PER_LINE)
+                wraps = xrange(first, base + end, CHARS_PER_LINE)
+                new_lines(wraps)
+                chars -= CHARS_PER_LINE * len(wraps)
+            state['chars'] = chars
+
+        base = 0
+        carry = ''
+        text_length = book.text_length
+        for record in book.text_records():
+            if carry:
+                base -= len(carry)
+                record = carry + record
+                carry = ''
+            # a tag split between two records is finished in the next one
+            lt = record.rfind('<')
+            if lt > record.rfind('>') and len(record) - lt < 4096:
+                carry = record[lt:]
+                record = record[:lt]
+            pos = 0
+            for m in TAGS.finditer(record):
+                text(record, pos, m.start(), base)
+                pos = m.end()
+                block = BLOCK_TAGS.match(record, m.start())
+                if block is None:
+                    continue
+                if block.group(1).lower() == 'mbp:pagebreak':
+                    state['lines'] = 0
+                    state['chars'] = None
+                    state['pending'] = None
+                else:
+                    state['pending'] = base + m.start()
+            text(record, pos, len(record), base)
+            base += len(record) + len(carry)
+        return [page for page in pages if page < text_length]
@@ -133,8 +133,10 @@ def del_exth(rec0, exth_num):
 
 class DualMobiMetaFix:
 
-    def __init__(self, infile):
-        self.datain = open(infile, 'rb').read()
+    def __init__(self, infile, datain=None):
+        if datain is None:
+            datain = open(infile, 'rb').read()
+        self.datain = datain
         self.datain_rec0 = readsection(self.datain, 0)
 
         rec0 = self.datain_rec0
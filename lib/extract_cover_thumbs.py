@@ -4,21 +4,29 @@
 from __future__ import print_function
 import sys
 import os
-import csv
 import shutil
 import tempfile
 
 from imghdr import what
 from io import BytesIO
-from datetime import datetime
+from multiprocessing import Pool
 
-import kindle_unpack
 from lib.apnx import APNXBuilder
-from lib.pages import find_exth
-from lib.pages import get_pages
+from lib.mobi_book import MobiBook
 from lib.get_real_pages import get_real_pages
+from lib.lookup_cache import LookupCache
 from lib.kfxmeta import get_kindle_kfx_metadata
+from lib.kfxmeta import COVER_METADATA_FIELDS
 from lib.dualmetafix import DualMobiMetaFix
+from lib.scan_index import ScanIndex
+from lib.readahead import read_ahead
+from lib.jpeg_density import jpeg_dpi
+from lib.library_scan import days_cutoff
+from lib.library_scan import scan_library
+from lib.page_database import PageDatabase
+from lib.page_database import is_real
+from lib.thumbnail_index import ThumbnailIndex
+from lib.thumbnail_index import thumbnail_name
 
 maindir = os.path.dirname(sys.argv[0])
 
@@ -28,6 +36,21 @@ try:
 except ImportError as e:
     sys.exit('CRITICAL! ' + str(e).decode(SFENC))
 
+RESAMPLE_FILTERS = {
+    'fast': Image.BILINEAR,
+    'balanced': Image.BICUBIC,
+    'best': Image.ANTIALIAS,
+}
+
+# size: bounding box of the thumbnail, padding: white band added below
+# PDOC covers for the PERSONAL badge; the sizes the tool has always used,
+# plain and for --fix-thumb. Profiles for other models (Oasis, Scribe)
+# belong here once their thumbnail sizes are known from the devices.
+THUMBNAIL_PROFILES = {
+    'default': {'size': (305, 470), 'padding': 0},
+    'fix-thumb': {'size': (283, 415), 'padding': 55},
+}
+
 def clean_temp(sourcedir):
     for p in os.listdir(os.path.join(sourcedir, os.pardir)):
             if 'epubQTools-tmp-' in p:
@@ -43,115 +66,384 @@ def clean_temp(sourcedir):
                             raise
 
 
-def asin_list_from_csv(mf):
-    if os.path.isfile(mf):
-        with open(mf) as f:
-            csvread = csv.reader(f, delimiter=';', quotechar='"',
-                                 quoting=csv.QUOTE_ALL)
-            asinlist = []
-            filelist = []
-            for row in csvread:
-                try:
-                    if row[0] != '* BRAK *':
-                        asinlist.append(row[0])
-                except IndexError:
-                    continue
-                filelist.append(row[6])
-            return asinlist, filelist
-    else:
-        with open(mf, 'wb') as o:
-            csvwrite = csv.writer(o, delimiter=';', quotechar='"',
-                                  quoting=csv.QUOTE_ALL)
-            csvwrite.writerow(
-                ['asin', 'lang', 'author', 'title', 'pages', 'is_real',
-                 'file_path']
-            )
-            return [], []
-
-
-def dump_pages(asinlist, filelist, mf, dirpath, fil):
-    row = get_pages(dirpath, fil)
-    if row is None:
-        return
-    if row[0] in asinlist:
-        return
-    if row[6] in filelist:
-        return
-    with open(mf, 'ab') as o:
-        print('* Uaktualnienie pliku CSV...')
-        csvwrite = csv.writer(o, delimiter=';', quotechar='"',
-                              quoting=csv.QUOTE_ALL)
-        csvwrite.writerow(row)
-
-def get_cover_image(section, mh, metadata, doctype, file, fide, is_verbose,
-                    fix_thumb):
+# ThumbnailIndex of every target directory, in the order of the targets;
+# set in the worker processes by set_thumbnail_indexes()
+thumbnail_indexes = []
+
+
+def thumbnail_path(thumb_dir, asin, doctype):
+    return os.path.join(thumb_dir, thumbnail_name(asin, doctype))
+
+
+def set_thumbnail_indexes(indexes):
+    global thumbnail_indexes
+    thumbnail_indexes = indexes
+
+
+def thumbnail_targets(kindlepath, profiles):
+    """
+    Pair every requested profile with the directory its thumbnails go to.
+
+    The first profile is written to the device, the others to
+    thumbnails/<profile> next to the program, ready to be copied to
+    other devices.
+    """
+    targets = []
+    for i, name in enumerate(profiles):
+        if i == 0:
+            thumb_dir = os.path.join(kindlepath, 'system', 'thumbnails')
+        else:
+            thumb_dir = os.path.join(maindir, 'thumbnails', name)
+        targets.append((THUMBNAIL_PROFILES[name], thumb_dir))
+    return targets
+
+
+def cover_is_current(entry, indexes, name, is_overwrite_pdoc_thumbs,
+                     is_overwrite_amzn_thumbs, patch_azw3):
+    if entry is None or not entry['thumbnail']:
+        return False
+    doctype = entry['doctype']
+    if is_overwrite_pdoc_thumbs and doctype == 'PDOC':
+        return False
+    if is_overwrite_amzn_thumbs and doctype in ('EBOK', 'EBSP'):
+        return False
+    if (patch_azw3 and doctype == 'PDOC' and
+            name.lower().endswith('.azw3')):
+        return False
+    return all(thumbs.has(entry['asin'], doctype) for thumbs in indexes)
+
+
+class ConsoleCapture(object):
+    """
+    Collects console output of a worker process to replay in order.
+
+    Text is encoded as the console of the parent would encode it, so a
+    message it cannot show fails in the worker, where the print
+    fallbacks of process_cover() catch it, and not on replay.
+    """
+
+    def __init__(self, encoding=None):
+        self.encoding = encoding or sys.getdefaultencoding()
+        self.chunks = []
+
+    def write(self, text):
+        if isinstance(text, unicode):
+            text = text.encode(self.encoding)
+        self.chunks.append(text)
+
+    def flush(self):
+        pass
+
+
+def capture_cover(task):
+    stdout = sys.stdout
+    sys.stdout = capture = ConsoleCapture(task[2]['encoding'])
+    try:
+        result = process_cover(task)
+    except Exception as e:
+        # goes back to the parent with the exception, to show the book
+        e.output = capture.chunks
+        raise
+    finally:
+        sys.stdout = stdout
+    result['output'] = capture.chunks
+    return result
+
+
+def replay_output(chunks):
+    for chunk in chunks:
+        sys.stdout.write(chunk)
+
+
+def prefetch_book(task):
+    mobi_path, skip, opts = task
+    if skip or mobi_path.lower().endswith(('.kfx', '.azw8')):
+        return None
     try:
-        cover_offset = metadata['CoverOffset'][0]
-    except KeyError:
+        return MobiBook(mobi_path).preload()
+    except Exception:
+        # process_cover() opens it again and reports the error
+        return None
+
+
+def process_cover(task, book=None):
+    """
+    Cover stage for a single book.
+
+    With --jobs this runs in a worker process, so apart from patching the
+    book itself it only reads from the device. The CSV row, the encoded
+    thumbnail and the scan index fields are returned for the parent to
+    write. A book already loaded by the read-ahead threads can be passed
+    in.
+    """
+    mobi_path, skip, opts = task
+    targets = opts['targets']
+    profiles = [profile for profile, thumb_dir in targets]
+    is_verbose = opts['is_verbose']
+    result = {'path': mobi_path, 'row': None, 'book': None, 'covers': None,
+              'fields': None}
+    name = os.path.basename(mobi_path)
+    if name.lower().endswith('.kfx') or name.lower().endswith('.azw8'):
+        is_kfx = True
+    else:
+        is_kfx = False
+    fide = name.decode(sys.getfilesystemencoding())
+    if is_verbose:
+        try:
+            print('* %s:' % fide, end=' ')
+        except:
+            print('* %r:' % fide, end=' ')
+    if skip:
+        if is_verbose:
+            print('Pominięto (bez zmian od ostatniego uruchomienia).')
+        return result
+    patched = False
+    if is_kfx:
+        try:
+            kfx_metadata = get_kindle_kfx_metadata(
+                mobi_path, raw_binary=True, fields=COVER_METADATA_FIELDS)
+        except Exception as e:
+            print('BŁĄD! Wyodrębnianie metadanych z %s: %s' % (
+                fide, unicode(e)
+            ))
+            return result
+        doctype = kfx_metadata.get("cde_content_type")
+        if not doctype:
+            print('BŁĄD! Brak typu dokumentu w "%s"' % fide)
+            return result
+        asin = kfx_metadata.get("ASIN")
+    else:
+        if book is None:
+            try:
+                book = MobiBook(mobi_path)
+            except Exception:
+                print('Błąd! Nie można otworzyć pliku %s' % mobi_path)
+                return result
+        result['row'] = book.pages_row()
+        if not book.is_mobi():
+            print('* Nieprawidłowy plik MOBI "%s".'
+                  % fide)
+            book.release()
+            return result
+        result['book'] = book
+        asin = book.asin
+        doctype = book.doctype
+    if (opts['patch_azw3'] is True and
+            doctype == 'PDOC' and
+            asin is not None and
+            name.lower().endswith('.azw3')):
+        print("POPRAWIANIE AZW3", end=' ')
+        dmf = DualMobiMetaFix(mobi_path, book.data)
+        book.release()
+        open(mobi_path, 'wb').write(dmf.getresult())
+        book = result['book'] = MobiBook(mobi_path, dmf.getresult())
+        doctype = 'EBOK'
+        patched = True
+    if asin is None:
+        print('BŁĄD! Brak numeru ASIN w "%s"' % fide.encode('utf8'))
+        if not is_kfx:
+            release_book(book, is_verbose)
+        return result
+    thumbpaths = [thumbnail_path(thumb_dir, asin, doctype)
+                  for profile, thumb_dir in targets]
+    if is_kfx:
+        pages = None
+    else:
+        row = book.pages_row()
+        pages = row[4] if row else None
+    if (not all(thumbs.has(asin, doctype)
+                for thumbs in thumbnail_indexes) or
+            (opts['is_overwrite_pdoc_thumbs'] and doctype == 'PDOC') or
+            (opts['is_overwrite_amzn_thumbs'] and (
+                doctype == 'EBOK' or doctype == 'EBSP'
+            ))):
+        if is_kfx:
+            image_data = kfx_metadata.get("cover_image_data")
+            if not image_data:
+                print('BŁĄD! Nie znaleziono okładki w "%s"' % fide)
+                return result
+        if is_verbose:
+            print('TWORZENIE OKŁADKI:', end=' ')
+        try:
+            if is_kfx:
+                covers = process_image(image_data, profiles, doctype,
+                                       is_verbose, opts['resample'])
+            else:
+                covers = get_cover_image(book, doctype, fide,
+                                         is_verbose, profiles,
+                                         opts['resample'])
+        except IOError:
+            print('Nie powiodło się! Nierozpoznany format obrazu...')
+            covers = False
+        if not is_kfx:
+            release_book(book, is_verbose)
+        if not covers:
+            return result
+        result['covers'] = []
+        for thumbpath, cover in zip(thumbpaths, covers):
+            thumb = BytesIO()
+            cover.save(thumb, 'JPEG')
+            result['covers'].append((thumbpath, thumb.getvalue()))
+    else:
+        if is_verbose:
+            print('Pominięto (okładka istnieje i nie wymuszono nadpisywania okładek).')
+        if not is_kfx:
+            release_book(book, is_verbose)
+    result['fields'] = {'asin': asin, 'doctype': doctype, 'pages': pages,
+                        'thumbnail': 1}
+    if patched:
+        result['fields']['patched'] = 1
+    return result
+
+
+def release_book(book, is_verbose):
+    book.release()
+    if is_verbose and book.bytes_read is not None:
+        print('  Odczytano %d B z pliku.' % book.bytes_read)
+
+
+def resource_type(data):
+    tmptype = data[0:4]
+    if tmptype in ["FLIS", "FCIS", "FDST", "DATP", "SRCS", "CMET",
+                   "FONT", "RESC"]:
+        return None
+    if len(data) == 4 and data[0:4] == chr(0xe9) + chr(0x8e) + "\r\n":
+        return None
+    imgtype = what(None, data)
+    if imgtype is None and data[0:2] == b'\xFF\xD8':
+        last = len(data)
+        while data[last - 1:last] == b'\x00':
+            last -= 1
+        if data[last - 2:last] == b'\xFF\xD9':
+            imgtype = "jpeg"
+    return imgtype
+
+
+def get_cover_image(book, doctype, fide, is_verbose, profiles,
+                    resample='best'):
+    cover_offset = book.exth_value('CoverOffset')
+    if cover_offset is None:
         print('BŁĄD! Nie znaleziono okładki w "%s"' % fide.encode('utf8'))
         return False
-    beg = mh.firstresource
-    end = section.num_sections
-    imgnames = []
-    for i in range(beg, end):
+    section = book.section
+    # every resource takes a slot, so the cover is CoverOffset records
+    # after the first resource
+    cover_section = book.cover_section()
+    if cover_section is not None:
+        data = section.load_section(cover_section)
+        if resource_type(data) is not None:
+            return process_image(data, profiles, doctype, is_verbose,
+                                 resample)
+    # malformed file, count the images instead
+    images = 0
+    for i in range(book.mh.firstresource, section.num_sections):
         data = section.load_section(i)
-        tmptype = data[0:4]
-        if tmptype in ["FLIS", "FCIS", "FDST", "DATP", "SRCS", "CMET",
-                       "FONT", "RESC"]:
-            imgnames.append(None)
+        if resource_type(data) is None:
             continue
-        if data == chr(0xe9) + chr(0x8e) + "\r\n":
-            imgnames.append(None)
-            continue
-        imgtype = what(None, data)
-        if imgtype is None and data[0:2] == b'\xFF\xD8':
-            last = len(data)
-            while data[last - 1:last] == b'\x00':
-                last -= 1
-            if data[last - 2:last] == b'\xFF\xD9':
-                imgtype = "jpeg"
-        if imgtype is None:
-            imgnames.append(None)
-        else:
-            imgnames.append(i)
-        if len(imgnames) - 1 == int(cover_offset):
-            return process_image(data, fix_thumb, doctype, is_verbose)
+        if images == int(cover_offset):
+            return process_image(data, profiles, doctype, is_verbose,
+                                 resample)
+        images += 1
+    # the cover record is missing or too short to be an image
+    print('Nie powiodło się! Nierozpoznany format obrazu...')
     return False
 
 
-def process_image(data, fix_thumb, doctype, is_verbose):
+class PassThroughCover(object):
+    """Cover that already meets the thumbnail specs, saved byte-for-byte."""
+
+    def __init__(self, data, size):
+        self.data = bytes(data)
+        self.size = size
+        self.mode = 'L'
+
+    def save(self, fp, format=None, **params):
+        if hasattr(fp, 'write'):
+            fp.write(self.data)
+        else:
+            with open(fp, 'wb') as f:
+                f.write(self.data)
+
+
+def is_thumbnail_ready(cover, profile, doctype):
+    """Check from the image header alone if cover can be used as is."""
+    size = profile['size']
+    return (cover.format == 'JPEG' and cover.mode == 'L' and
+            'progressive' not in cover.info and
+            cover.size[0] <= size[0] and cover.size[1] <= size[1] and
+            not (doctype == 'PDOC' and profile['padding']))
+
+
+def process_image(data, profiles, doctype, is_verbose, resample='best'):
+    """
+    Make one thumbnail for every profile out of a single decode.
+
+    The cover is decoded once and shrunk to the largest profile, and
+    every thumbnail is resampled from that intermediate image. Covers
+    that already fit a profile are passed through without re-encoding.
+    """
     cover = Image.open(BytesIO(data))
-    if fix_thumb:
-        cover.thumbnail((283, 415), Image.ANTIALIAS)
-    else:
-        cover.thumbnail((305, 470), Image.ANTIALIAS)
-    cover = cover.convert('L')
-    if doctype == 'PDOC' and fix_thumb:
-        pdoc_cover = Image.new(
-            "L",
-            (cover.size[0], cover.size[1] + 55),
-            "white"
-        )
-        pdoc_cover.paste(cover, (0, 0))
-        return pdoc_cover
-    else:
+    ready = [is_thumbnail_ready(cover, profile, doctype)
+             for profile in profiles]
+    if all(ready):
         if is_verbose:
-            print('GOTOWE!')
-        return cover
+            print('GOTOWE! (bez ponownego kodowania)')
+        return [PassThroughCover(data, cover.size) for profile in profiles]
+    size = (max(profile['size'][0] for profile in profiles),
+            max(profile['size'][1] for profile in profiles))
+    # let libjpeg decode straight to grayscale at 1/2, 1/4 or 1/8 scale
+    cover.draft('L', size)
+    # shared intermediate, every profile is resampled from this small image
+    decoded = cover.convert('L')
+    decoded.thumbnail(size, RESAMPLE_FILTERS[resample])
+    covers = []
+    for profile, is_ready in zip(profiles, ready):
+        if is_ready:
+            covers.append(PassThroughCover(data, cover.size))
+            continue
+        thumb = decoded.copy()
+        thumb.thumbnail(profile['size'], RESAMPLE_FILTERS[resample])
+        if doctype == 'PDOC' and profile['padding']:
+            pdoc_cover = Image.new(
+                "L",
+                (thumb.size[0], thumb.size[1] + profile['padding']),
+                "white"
+            )
+            pdoc_cover.paste(thumb, (0, 0))
+            thumb = pdoc_cover
+        covers.append(thumb)
+    if is_verbose:
+        print('GOTOWE!')
+    return covers
 
 
 def fix_generated_thumbs(file, is_verbose, fix_thumb):
+    """
+    Add or remove the PERSONAL badge band of a thumbnail made by the Kindle.
+
+    The density tells which state the thumbnail is in. It is read from
+    the JPEG header, so the image is only decoded when it is fixed.
+    """
     try:
-        cover = Image.open(file)
+        dpi = jpeg_dpi(file)
     except IOError:
         return False
-    try:
-        dpi = cover.info["dpi"]
-    except KeyError:
-        dpi = (96, 96)
+    cover = None
+    if dpi is None:
+        try:
+            cover = Image.open(file)
+        except IOError:
+            return False
+        try:
+            dpi = cover.info["dpi"]
+        except KeyError:
+            dpi = (96, 96)
+    dpi = tuple(dpi)
     if dpi == (96, 96) and fix_thumb:
         if is_verbose:
             print('* Naprawa wygenerowanej miniatury "%s"...' % (file))
+        if cover is None:
+            cover = Image.open(file)
         pdoc_cover = Image.new("L", (cover.size[0], cover.size[1] + 45),
                                "white")
         pdoc_cover.paste(cover, (0, 0))
@@ -159,6 +451,8 @@ def fix_generated_thumbs(file, is_verbose, fix_thumb):
     elif dpi == (72, 72) and not fix_thumb:
         if is_verbose:
             print('* Cofniecie naprawy wygenerowanej miniatury "%s"...' % (file))
+        if cover is None:
+            cover = Image.open(file)
         pdoc_cover = Image.new("L", (cover.size[0], cover.size[1] - 45),
                                "white")
         pdoc_cover.paste(cover, (0, 0))
@@ -171,94 +465,112 @@ def fix_generated_thumbs(file, is_verbose, fix_thumb):
 
 
 def generate_apnx_files(docs, is_verbose, is_overwrite_apnx, days,
-                        tempdir):
+                        pagedb=None, books=None, index=None,
+                        read_ahead_depth=4, accurate=False, library=None):
+    if books is None:
+        books = {}
+    if library is None:
+        library = scan_library(docs, cutoff=days_cutoff(days))
     apnx_builder = APNXBuilder()
-    if days is not None:
-        dtt = datetime.today()
-        days_int = int(days)
-    else:
-        days_int = 0
-        diff = 0
-    for root, dirs, files in os.walk(docs):
-        for name in files:
-            if 'documents' + os.path.sep + 'dictionaries' in root:
+    candidates = []
+    sizes = {}
+    for found in library:
+        name = found.name
+        if not name.lower().endswith(('.azw3', '.mobi', '.azw')):
+            continue
+        mobi_path = found.path
+        sdr_dir = os.path.join(found.root, os.path.splitext(
+                               name)[0] + '.sdr')
+        apnx_path = os.path.join(sdr_dir, os.path.splitext(
+                                 name)[0] + '.apnx')
+        if index is not None and not is_overwrite_apnx:
+            entry = index.unchanged(mobi_path)
+            # the index only knows the book, the APNX may have been removed
+            if (entry is not None and entry['apnx'] and
+                    os.path.isfile(apnx_path)):
                 continue
-            mobi_path = os.path.join(root, name)
-            if days is not None:
+        if not found.has_sidecar and not os.path.isdir(sdr_dir):
+            os.makedirs(sdr_dir)
+        if not os.path.isfile(apnx_path) or is_overwrite_apnx:
+            candidates.append((mobi_path, name, apnx_path))
+            sizes[mobi_path] = found.st.st_size
+        elif index is not None:
+            index.update(mobi_path, apnx=1)
+
+    def load_book(candidate):
+        book = books.get(candidate[0])
+        if book is None:
+            try:
+                book = MobiBook(candidate[0])
+            except Exception:
+                # reported when its turn comes, the other books go on
+                return None
+            if book.is_mobi():
                 try:
-                    dt = os.path.getctime(mobi_path)
-                except OSError:
-                    continue
-                dt = datetime.fromtimestamp(dt).strftime('%Y-%m-%d')
-                dt = datetime.strptime(dt, '%Y-%m-%d')
-                diff = (dtt - dt).days
-            if name.lower().endswith(('.azw3', '.mobi', '.azw')) and diff <= days_int:
-                sdr_dir = os.path.join(root, os.path.splitext(
-                                       name)[0] + '.sdr')
-                if not os.path.isdir(sdr_dir):
-                    os.makedirs(sdr_dir)
-                apnx_path = os.path.join(sdr_dir, os.path.splitext(
-                                         name)[0] + '.apnx')
-                if not os.path.isfile(apnx_path) or is_overwrite_apnx:
-                    if is_verbose:
-                        print('* Generowanie pliku APNX dla "%s"'
-                              % name.decode(sys.getfilesystemencoding()))
-                        if os.path.isfile(os.path.join(
-                                tempdir, 'ect.csv')):
-                            with open(os.path.join(
-                                    tempdir, 'ect.csv'
-                            ), 'rb') as f1:
-                                csvread = csv.reader(
-                                    f1, delimiter=';', quotechar='"',
-                                    quoting=csv.QUOTE_ALL
-                                )
-                                with open(mobi_path, 'rb') as f2:
-                                    mobi_content = f2.read()
-                                if mobi_content[60:68] != 'BOOKMOBI':
-                                    print('* Nieprawidłowy formatpliku. Pomijam...')
-                                    asin = ''
-                                else:
-                                    asin = find_exth(113, mobi_content)
-                                found = False
-                                for i in csvread:
-                                    try:
-                                        if (
-                                            i[0] == asin and i[0] != '* NONE *'
-                                        ) or (
-                                            i[0] == '* NONE *' and i[6] == name
-                                        ):
-                                            print(
-                                                '  * Użycie %s stron zdefiniowanych w pliku CSV' % (i[4]))
-                                            apnx_builder.write_apnx(
-                                                mobi_path, apnx_path, int(i[4])
-                                            )
-                                            found = True
-                                            continue
-                                    except IndexError:
-                                        continue
-                                if not found:
-                                    print(
-                                        '  ! Książka nie znaleziona w '
-                                        'ect.csv.'
-                                        ' Użycie szybkiego algorytmu...')
-                                    apnx_builder.write_apnx(mobi_path, apnx_path)
-                        else:
-                            apnx_builder.write_apnx(mobi_path, apnx_path)
+                    book.metadata
+                except Exception:
+                    pass
+        return book
+
+    def book_size(candidate):
+        if candidate[0] in books:
+            return 0
+        return sizes[candidate[0]]
+
+    for (mobi_path, name, apnx_path), book in read_ahead(
+            candidates, load_book, read_ahead_depth, size=book_size):
+        if is_verbose:
+            print('* Generowanie pliku APNX dla "%s"'
+                  % name.decode(sys.getfilesystemencoding()))
+        if book is None:
+            print('Błąd! Nie można otworzyć pliku %s' % mobi_path)
+            continue
+        if pagedb is not None:
+            if not book.is_mobi():
+                print('* Nieprawidłowy formatpliku. Pomijam...')
+                asin = ''
+            else:
+                asin = book.find_exth(113)
+            row = pagedb.find(asin, name)
+            if row is not None and accurate and not is_real(row):
+                # only estimated, let the text decide
+                print('  * Użycie dokładnego algorytmu')
+                apnx_builder.write_apnx(mobi_path, apnx_path, book=book,
+                                        accurate=True)
+            elif row is not None:
+                print(
+                    '  * Użycie %s stron zdefiniowanych w pliku CSV' % (row[4]))
+                apnx_builder.write_apnx(
+                    mobi_path, apnx_path, int(row[4]),
+                    book=book
+                )
+            else:
+                print(
+                    '  ! Książka nie znaleziona w '
+                    'ect.csv.'
+                    ' Użycie %s algorytmu...' % (
+                        'dokładnego' if accurate else 'szybkiego'))
+                apnx_builder.write_apnx(mobi_path, apnx_path,
+                                        book=book, accurate=accurate)
+        else:
+            apnx_builder.write_apnx(mobi_path, apnx_path,
+                                    book=book, accurate=accurate)
+        book.release()
+        if index is not None and os.path.isfile(apnx_path):
+            index.update(mobi_path, apnx=1)
 
 
 def extract_cover_thumbs(is_silent, is_overwrite_pdoc_thumbs,
                          is_overwrite_amzn_thumbs, is_overwrite_apnx,
                          skip_apnx, kindlepath, is_azw, days, fix_thumb,
-                         lubimy_czytac, mark_real_pages, patch_azw3):
+                         lubimy_czytac, mark_real_pages, patch_azw3,
+                         full_scan=False, jobs=1, read_ahead_depth=4,
+                         resample='best', profiles=None,
+                         accurate_apnx=False, lookup_jobs=4):
     docs = os.path.join(kindlepath, 'documents')
     is_verbose = not is_silent
     if days is not None:
-        dtt = datetime.today()
-        days_int = int(days)
         print('Ostrzeżenie! Przetwarzanie plików nie starszych niż ' + days + ' dni.')
-    else:
-        days_int = 0
-        diff = 0
 
     tempdir = tempfile.mkdtemp(suffix='', prefix='extract_cover_thumbs-tmp-')
     csv_pages_name = 'ect.csv'
@@ -267,145 +579,127 @@ def extract_cover_thumbs(is_silent, is_overwrite_pdoc_thumbs,
         shutil.copy2(os.path.join(maindir, csv_pages_name),
                      os.path.join(tempdir, csv_pages_name))
 
-    asinlist, filelist = asin_list_from_csv(csv_pages)
+    pagedb = PageDatabase(csv_pages)
+    books = {}
 
     if not os.path.isdir(os.path.join(kindlepath, 'system', 'thumbnails')):
         print('* BŁĄD! Nie znaleziono urządzenia Kindle w podanej ścieżce: "' +
               os.path.join(kindlepath) + '"')
         return 1
-    print("ROZPOCZYNAM wydobywanie okładek...")
-    if is_azw:
-        extensions = ('.azw', '.azw3', '.mobi', '.kfx', '.azw8')
-    else:
-        extensions = ('.azw3', '.mobi', '.kfx', '.azw8')
-    for root, dirs, files in os.walk(docs):
-        for name in files:
-            if days is not None:
-                try:
-                    dt = os.path.getctime(os.path.join(root, name))
-                except OSError:
-                    continue
-                dt = datetime.fromtimestamp(dt).strftime('%Y-%m-%d')
-                dt = datetime.strptime(dt, '%Y-%m-%d')
-                diff = (dtt - dt).days
-            if name.lower().endswith(extensions) and diff <= days_int:
-                if name.lower().endswith('.kfx') or name.lower().endswith('.azw8'):
-                    is_kfx = True
-                else:
-                    is_kfx = False
-                fide = name.decode(sys.getfilesystemencoding())
-                if is_verbose:
-                    try:
-                        print('* %s:' % fide, end=' ')
-                    except:
-                        print('* %r:' % fide, end=' ')
-                mobi_path = os.path.join(root, name)
-                if is_kfx:
-                    try:
-                        kfx_metadata = get_kindle_kfx_metadata(mobi_path)
-                    except Exception as e:
-                        print('BŁĄD! Wyodrębnianie metadanych z %s: %s' % (
-                            fide, unicode(e)
-                        ))
-                        continue
-                    doctype = kfx_metadata.get("cde_content_type")
-                    if not doctype:
-                        print('BŁĄD! Brak typu dokumentu w "%s"' % fide)
-                        continue
-                    asin = kfx_metadata.get("ASIN")
+    index = ScanIndex(os.path.join(maindir, 'ect_index.sqlite'), kindlepath)
+
+    def save_pages():
+        # keep ect.csv in step with the scan index, also if the run fails
+        pagedb.flush()
+        shutil.copy2(csv_pages, os.path.join(maindir, csv_pages_name))
+
+    try:
+        print("ROZPOCZYNAM wydobywanie okładek...")
+        if is_azw:
+            extensions = ('.azw', '.azw3', '.mobi', '.kfx', '.azw8')
+        else:
+            extensions = ('.azw3', '.mobi', '.kfx', '.azw8')
+        if not profiles:
+            profiles = ['fix-thumb' if fix_thumb else 'default']
+        targets = thumbnail_targets(kindlepath, profiles)
+        for profile, thumb_dir in targets[1:]:
+            if not os.path.isdir(thumb_dir):
+                os.makedirs(thumb_dir)
+        thumbnails = [ThumbnailIndex(thumb_dir)
+                      for profile, thumb_dir in targets]
+        set_thumbnail_indexes(thumbnails)
+        opts = {
+            'is_verbose': is_verbose,
+            'is_overwrite_pdoc_thumbs': is_overwrite_pdoc_thumbs,
+            'is_overwrite_amzn_thumbs': is_overwrite_amzn_thumbs,
+            'targets': targets,
+            'resample': resample,
+            'patch_azw3': patch_azw3,
+            'encoding': sys.stdout.encoding,
+        }
+        tasks = []
+        sizes = {}
+        library = scan_library(docs, cutoff=days_cutoff(days))
+        for found in library:
+            if found.name.lower().endswith(extensions):
+                entry = index.unchanged(found.path, found.st)
+                skip = not full_scan and cover_is_current(
+                    entry, thumbnails, found.name,
+                    is_overwrite_pdoc_thumbs, is_overwrite_amzn_thumbs,
+                    patch_azw3)
+                if (skip and not found.name.lower().endswith(('.kfx', '.azw8'))
+                        and pagedb.find(entry['asin'], found.name) is None):
+                    # parse it again to bring back its row missing from ect.csv
+                    skip = False
+                tasks.append((found.path, skip, opts))
+                if not skip:
+                    sizes[found.path] = found.st.st_size
+
+        def task_size(task):
+            # prefetch_book() loads at most the whole file
+            if task[0].lower().endswith(('.kfx', '.azw8')):
+                return 0
+            return sizes.get(task[0], 0)
+
+        pool = None
+        if jobs > 1 and len(tasks) > 1:
+            pool = Pool(jobs, set_thumbnail_indexes, (thumbnails,))
+            results = pool.imap(capture_cover, tasks)
+        else:
+            results = (process_cover(task, book) for task, book in read_ahead(
+                tasks, prefetch_book, read_ahead_depth, size=task_size))
+        finished = False
+        try:
+            for result in results:
+                replay_output(result.get('output', ()))
+                mobi_path = result['path']
+                if result['row'] is not None:
+                    pagedb.add(result['row'])
+                if result['book'] is not None:
+                    books[mobi_path] = result['book']
+                for thumbs, (thumbpath, data) in zip(thumbnails,
+                                                     result['covers'] or ()):
+                    with open(thumbpath, 'wb') as f:
+                        f.write(data)
+                    thumbs.add(thumbpath)
+                if result['fields'] is not None:
+                    index.update(mobi_path, **result['fields'])
+            finished = True
+        except Exception as e:
+            # what a worker printed for the book it failed on
+            replay_output(getattr(e, 'output', ()))
+            raise
+        finally:
+            if pool is not None:
+                if finished:
+                    pool.close()
                 else:
-                    dump_pages(asinlist, filelist, csv_pages, root, name)
-                    with open(mobi_path, 'rb') as mf:
-                        mobi_content = mf.read()
-                        if mobi_content[60:68] != 'BOOKMOBI':
-                            print('* Nieprawidłowy plik MOBI "%s".'
-                                  % fide)
-                            continue
-                    section = kindle_unpack.Sectionizer(mobi_path)
-                    mhlst = [kindle_unpack.MobiHeader(section, 0)]
-                    mh = mhlst[0]
-                    metadata = mh.getmetadata()
-                    try:
-                        asin = metadata['ASIN'][0]
-                    except KeyError:
-                        asin = None
-                    try:
-                        doctype = metadata['Document Type'][0]
-                    except KeyError:
-                        doctype = None
-                if (patch_azw3 is True and
-                        doctype == 'PDOC' and
-                        asin is not None and
-                        name.lower().endswith('.azw3')):
-                    print("POPRAWIANIE AZW3", end=' ')
-                    dmf = DualMobiMetaFix(mobi_path)
-                    open(mobi_path, 'wb').write(dmf.getresult())
-                    doctype = 'EBOK'
-                if asin is None:
-                    print('BŁĄD! Brak numeru ASIN w "%s"' % fide.encode('utf8'))
-                    continue
-                thumbpath = os.path.join(
-                    kindlepath, 'system', 'thumbnails',
-                    'thumbnail_%s_%s_portrait.jpg' % (asin, doctype)
-                )
-                if (not os.path.isfile(thumbpath) or
-                        (is_overwrite_pdoc_thumbs and doctype == 'PDOC') or
-                        (is_overwrite_amzn_thumbs and (
-                            doctype == 'EBOK' or doctype == 'EBSP'
-                        ))):
-                    if is_kfx:
-                        image_data = kfx_metadata.get("cover_image_data")
-                        if not image_data:
-							print('BŁĄD! Nie znaleziono okładki w "%s"' % fide)
-							continue
-                    if is_verbose:
-                        print('TWORZENIE OKŁADKI:', end=' ')
-                    try:
-                        if is_kfx:
-                            cover = process_image(image_data.decode('base64'),
-                                                  fix_thumb, doctype,
-                                                  is_verbose)
-                        else:
-                            cover = get_cover_image(section, mh, metadata,
-                                                    doctype, name,
-                                                    fide, is_verbose, fix_thumb)
-                    except IOError:
-                        print('Nie powiodło się! Nierozpoznany format obrazu...')
-                        continue
-                    if not cover:
-                        continue
-                    cover.save(thumbpath)
-                elif is_verbose:
-                    print('Pominięto (okładka istnieje i nie wymuszono nadpisywania okładek).')
-    if lubimy_czytac and days:
-        print("ROZPOCZYNAM pobieranie prawdziwych numerów stron...")
-        get_real_pages(os.path.join(
-            tempdir, 'ect.csv'), mark_real_pages)
-        print("KONIEC pobierania prawdziwych numerów stron...")
-    if not skip_apnx:
-        print("ROZPOCZYNAM generowanie numerów stron (plików APNX)...")
-        generate_apnx_files(docs, is_verbose, is_overwrite_apnx,
-                            days, tempdir)
-        print("KONIEC generowania numerów stron (plików APNX)...")
-
-    if is_overwrite_pdoc_thumbs:
-        thumb_dir = os.path.join(kindlepath, 'system', 'thumbnails')
-        thumb_list = os.listdir(thumb_dir)
-        for c in thumb_list:
-            if c.startswith('thumbnail') and c.endswith('.jpg'):
-                if c.endswith('portrait.jpg'):
-                    continue
-                fix_generated_thumbs(os.path.join(thumb_dir, c),
-                                     is_verbose, fix_thumb)
+                    pool.terminate()
+                pool.join()
+        if lubimy_czytac and days:
+            print("ROZPOCZYNAM pobieranie prawdziwych numerów stron...")
+            cache = LookupCache(os.path.join(maindir, 'ect_lookups.sqlite'))
+            try:
+                get_real_pages(pagedb, mark_real_pages, lookup_jobs,
+                               checkpoint=save_pages, cache=cache)
+            finally:
+                cache.close()
+            print("KONIEC pobierania prawdziwych numerów stron...")
+        if not skip_apnx:
+            print("ROZPOCZYNAM generowanie numerów stron (plików APNX)...")
+            generate_apnx_files(docs, is_verbose, is_overwrite_apnx,
+                                days, pagedb, books, index, read_ahead_depth,
+                                accurate_apnx, library)
+            print("KONIEC generowania numerów stron (plików APNX)...")
+
+        if is_overwrite_pdoc_thumbs:
+            for thumbpath in thumbnails[0].paths(
+                    exclude_orientation='portrait'):
+                fix_generated_thumbs(thumbpath, is_verbose, fix_thumb)
+    finally:
+        save_pages()
+        index.close()
     print("KONIEC wydobywania okładek...")
-    shutil.copy2(os.path.join(tempdir, csv_pages_name),
-                 os.path.join(maindir, csv_pages_name))
     clean_temp(tempdir)
-    
-    for root, dirs, files in os.walk(kindlepath, 'system', 'thumbnails'):
-        for name in files:
-            if name.lower().endswith('.partial'):
-				os.remove(kindlepath + 'system' + os.path.sep + 'thumbnails' + os.path.sep + name)
-				
-	
+    thumbnails[0].remove_partial()
     return 0
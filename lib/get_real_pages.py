@@ -3,14 +3,41 @@
 #
 
 from __future__ import print_function
+from itertools import izip
+from multiprocessing.pool import ThreadPool
 
+from lib.http_client import HTTPClient
+from lib.http_client import RateLimiter
+from lib.lookup_cache import normalize
+from lib.page_database import is_real
 
-def get_real_pages(csvfile, mark_real_pages):
+LUBIMY_CZYTAC_URL = 'http://lubimyczytac.pl'
+# seconds between two requests sent to the site
+REQUEST_INTERVAL = 0.25
+# changed rows after which ect.csv is saved
+CHECKPOINT_ROWS = 25
+
+
+def get_real_pages(pagedb, mark_real_pages, jobs=4,
+                   base_url=LUBIMY_CZYTAC_URL, checkpoint=None, client=None,
+                   cache=None):
+    """
+    Look up real page counts of the rows of a PageDatabase.
+
+    Up to jobs books are looked up at once, by default over kept-alive
+    connections sending at most one request every REQUEST_INTERVAL
+    seconds. Results are reported in the order of the rows and
+    checkpoint, if given, is called after every CHECKPOINT_ROWS changed
+    rows and at the end.
+
+    With a LookupCache as cache, search results by title and author and
+    book pages by URL are taken from it when possible, including
+    searches that found nothing.
+    """
 
-    import os
-    import csv
     import urllib
     import urllib2
+    import urlparse
     import unicodedata
     import sys
 
@@ -25,12 +52,14 @@ def get_real_pages(csvfile, mark_real_pages):
             'NFKD', text
         ) if unicodedata.category(c) != 'Mn')
 
+    if client is None:
+        client = HTTPClient(RateLimiter(REQUEST_INTERVAL))
+
     def get_html_page(url):
-        req = urllib2.Request(url)
-        return fromstring(urllib2.urlopen(req).read())
+        return fromstring(client.get(urlparse.urljoin(base_url, url)))
 
     def search_book(category):
-        url = 'http://lubimyczytac.pl/szukaj/ksiazki'
+        url = '/szukaj/ksiazki'
         data = urllib.urlencode({
             'phrase': category,
             'main_search': '1',
@@ -55,7 +84,7 @@ def get_real_pages(csvfile, mark_real_pages):
         else:
             return None, book_type
 
-    def get_search_results(tree, author, title):
+    def get_search_results(tree, author, title, log):
         title = title.decode('UTF-8').lower().encode('UTF-8')
         author = author.decode('UTF-8').lower().encode('UTF-8')
         results = tree.xpath('*//div[contains(@class,"book-data")]')
@@ -66,7 +95,7 @@ def get_real_pages(csvfile, mark_real_pages):
             )[0]
             return book_url
         elif len(results) == 0:
-            print('  No results...')
+            log.append('  No results...')
         else:
             for result in results:
                 try:
@@ -114,55 +143,95 @@ def get_real_pages(csvfile, mark_real_pages):
                     elif a_srt == a_fsrt:
                         return book_url
                         break
-            print('  No matches in results...')
-
-    if os.path.isfile(os.path.join(csvfile)):
-        with open(os.path.join(csvfile), 'rb') as f:
-            csvread = csv.reader(
-                f, delimiter=';', quotechar='"',
-                quoting=csv.QUOTE_ALL
-            )
-            dumped_list = list(csvread)
-            for row in dumped_list:
-                try:
-                    if row[0] == 'asin' or row[5] == 'True' or not(
-                        row[1].lower() == 'pl' or row[1].lower() == 'pl-pl'
-                    ):
-                        continue
-                    print('* Szukam dla: ' + row[2].decode(
-                          'UTF-8') + ' - ' + row[3].decode('UTF-8'))
-                except IndexError:
-                    continue
-                try:
-                    root = search_book(row[3])
-                    if len(root.xpath(
-                        '*//div[contains(@class,"book-data")]'
-                    )) == 0:
-                        root = search_book(row[3].split('.')[0])
-                    book_url = get_search_results(root, row[2], row[3])
-                except urllib2.HTTPError:
-                    print('  ! HTTP error. Unable to find the book details...')
-                    book_url = None
-                if book_url:
-                    pages, book_type = get_pages_book_type(book_url)
-                    if pages is not None:
-                        row[4] = pages
-                        row[5] = True
-                        print('  Liczba stron w książce:', pages)
-                    elif book_type == 'E-book':
-                        print('  ! Tylko format e-booków! '
-                              'Użyj obliczone numery stron jako prawdziwe...')
-                        row[5] = True
-                    else:
-                        print('  ! Nie są ustawione numery stron '
-                              'na stronie: ' + book_url)
-                elif mark_real_pages:
-                    print('  ! Oznacz obliczone numery stron jako prawdziwe...')
-                    row[5] = True
+            log.append('  No matches in results...')
 
-                with open(os.path.join(csvfile), 'wb') as f:
-                    csvwrite = csv.writer(
-                        f, delimiter=';', quotechar='"',
-                        quoting=csv.QUOTE_ALL
-                    )
-                    csvwrite.writerows(dumped_list)
+    def find_book(author, title, log):
+        key = 'search:%s|%s' % (normalize(title), normalize(author))
+        cached = cache.get(key) if cache is not None else None
+        if cached is not None:
+            log.extend(cached['log'])
+            return cached['url']
+        search_log = []
+        root = search_book(title)
+        if len(root.xpath(
+            '*//div[contains(@class,"book-data")]'
+        )) == 0:
+            root = search_book(title.split('.')[0])
+        book_url = get_search_results(root, author, title, search_log)
+        if cache is not None:
+            cache.put(key, {'url': book_url, 'log': search_log},
+                      negative=not book_url)
+        log.extend(search_log)
+        return book_url
+
+    def book_details(book_url):
+        key = 'book:' + urlparse.urljoin(base_url, book_url)
+        cached = cache.get(key) if cache is not None else None
+        if cached is not None:
+            return cached['pages'], cached['type']
+        pages, book_type = get_pages_book_type(book_url)
+        if cache is not None:
+            cache.put(key, {'pages': pages, 'type': book_type},
+                      negative=pages is None)
+        return pages, book_type
+
+    def lookup(row):
+        log = []
+        try:
+            book_url = find_book(row[2], row[3], log)
+            if book_url:
+                return (log, book_url) + book_details(book_url)
+        except urllib2.HTTPError:
+            log.append('  ! HTTP error. Unable to find the book details...')
+        except IOError:
+            log.append('  ! Network error. '
+                       'Unable to find the book details...')
+        return log, None, None, None
+
+    rows = []
+    for row in pagedb.rows:
+        try:
+            if row[0] == 'asin' or is_real(row) or not(
+                row[1].lower() == 'pl' or row[1].lower() == 'pl-pl'
+            ):
+                continue
+        except IndexError:
+            continue
+        rows.append(row)
+
+    pool = ThreadPool(max(jobs, 1))
+    changed = 0
+    try:
+        for row, (log, book_url, pages, book_type) in izip(
+                rows, pool.imap(lookup, rows)):
+            print('* Szukam dla: ' + row[2].decode(
+                  'UTF-8') + ' - ' + row[3].decode('UTF-8'))
+            for line in log:
+                print(line)
+            if book_url:
+                if pages is not None:
+                    row[4] = pages
+                    row[5] = True
+                    print('  Liczba stron w książce:', pages)
+                elif book_type == 'E-book':
+                    print('  ! Tylko format e-booków! '
+                          'Użyj obliczone numery stron jako prawdziwe...')
+                    row[5] = True
+                else:
+                    print('  ! Nie są ustawione numery stron '
+                          'na stronie: ' + book_url)
+            elif mark_real_pages:
+                print('  ! Oznacz obliczone numery stron jako prawdziwe...')
+                row[5] = True
+            if is_real(row):
+                pagedb.changed()
+                changed += 1
+                if checkpoint is not None and \
+                        changed % CHECKPOINT_ROWS == 0:
+                    checkpoint()
+    finally:
+        pool.terminate()
+        pool.join()
+        client.close()
+        if checkpoint is not None and changed % CHECKPOINT_ROWS:
+            checkpoint()
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+#
+
+import base64
+import httplib
+import socket
+import threading
+import time
+import urllib
+import urllib2
+import urlparse
+
+REDIRECTS = (301, 302, 303, 307, 308)
+MAX_REDIRECTS = 5
+# what urllib2.urlopen() sends
+USER_AGENT = 'Python-urllib/%s' % urllib2.__version__
+
+
+class RateLimiter(object):
+    """Spaces the requests sent to each host at least interval apart."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.next_slot = {}
+
+    def wait(self, host):
+        with self.lock:
+            now = time.time()
+            slot = max(now, self.next_slot.get(host, 0))
+            self.next_slot[host] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class HTTPClient(object):
+    """
+    GET requests over kept-alive connections, safe to share by threads.
+
+    Every thread keeps one connection per host and reuses it until the
+    server closes it. Connection errors, 429 and 5xx answers are retried
+    up to retries times, waiting backoff seconds and doubling the wait
+    after every attempt. Other 4xx answers raise urllib2.HTTPError, like
+    urllib2.urlopen() does.
+
+    Like urllib2, proxies come from the environment (http_proxy,
+    https_proxy and no_proxy) unless given as a scheme to URL dict, and
+    the User-Agent of urllib2 is sent unless headers set another one.
+    """
+
+    def __init__(self, rate_limiter=None, retries=3, backoff=1.0,
+                 timeout=30, headers=None, proxies=None):
+        self.rate_limiter = rate_limiter
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.headers = {'User-Agent': USER_AGENT}
+        self.headers.update(headers or {})
+        if proxies is None:
+            proxies = urllib.getproxies()
+        self.proxies = proxies
+        self.local = threading.local()
+        # the connections of every thread, for close()
+        self.lock = threading.Lock()
+        self.thread_connections = []
+
+    def proxy(self, scheme, host):
+        """Split URL of the proxy for scheme://host or None."""
+        proxy = self.proxies.get(scheme)
+        if not proxy or urllib.proxy_bypass(host):
+            return None
+        if '://' not in proxy:
+            proxy = 'http://' + proxy
+        return urlparse.urlsplit(proxy)
+
+    def proxy_headers(self, proxy):
+        if proxy.username is None:
+            return {}
+        credentials = '%s:%s' % (urllib.unquote(proxy.username),
+                                 urllib.unquote(proxy.password or ''))
+        return {'Proxy-Authorization':
+                'Basic ' + base64.b64encode(credentials)}
+
+    def connection(self, scheme, host):
+        connections = self.local.__dict__.get('connections')
+        if connections is None:
+            connections = self.local.connections = {}
+            with self.lock:
+                self.thread_connections.append(connections)
+        conn = connections.get((scheme, host))
+        if conn is None:
+            proxy = self.proxy(scheme, host)
+            if proxy is None:
+                address = host
+            else:
+                address = proxy.netloc.rpartition('@')[2]
+            if scheme == 'https':
+                conn = httplib.HTTPSConnection(address, timeout=self.timeout)
+                if proxy is not None:
+                    # CONNECT through the proxy, TLS with the host itself
+                    conn.set_tunnel(host, headers=self.proxy_headers(proxy))
+            else:
+                conn = httplib.HTTPConnection(address, timeout=self.timeout)
+            connections[(scheme, host)] = conn
+        return conn
+
+    def disconnect(self, scheme, host):
+        connections = self.local.__dict__.get('connections', {})
+        conn = connections.pop((scheme, host), None)
+        if conn is not None:
+            conn.close()
+
+    def close(self):
+        """Close the connections of all threads, once they are done."""
+        with self.lock:
+            for connections in self.thread_connections:
+                while connections:
+                    connections.popitem()[1].close()
+
+    def request(self, scheme, host, path):
+        delay = self.backoff
+        attempt = 0
+        headers = self.headers
+        proxy = self.proxy(scheme, host)
+        if proxy is not None and scheme != 'https':
+            # a plain HTTP proxy is sent the whole URL
+            path = '%s://%s%s' % (scheme, host, path)
+            headers = dict(headers, **self.proxy_headers(proxy))
+        while True:
+            if self.rate_limiter is not None:
+                self.rate_limiter.wait(host)
+            connections = self.local.__dict__.get('connections', {})
+            reused = (scheme, host) in connections
+            conn = self.connection(scheme, host)
+            try:
+                conn.request('GET', path, headers=headers)
+                response = conn.getresponse()
+                body = response.read()
+            except (socket.error, httplib.HTTPException) as e:
+                self.disconnect(scheme, host)
+                if reused:
+                    # the server closed the idle connection, not a failure
+                    continue
+                error = IOError('%s: %s' % (host, e))
+            else:
+                if response.will_close:
+                    self.disconnect(scheme, host)
+                if response.status != 429 and response.status < 500:
+                    return response, body
+                error = None
+            if attempt == self.retries:
+                if error is not None:
+                    raise error
+                return response, body
+            attempt += 1
+            time.sleep(delay)
+            delay *= 2
+
+    def get(self, url):
+        """Return the body of url, following redirects."""
+        for _ in range(MAX_REDIRECTS + 1):
+            parts = urlparse.urlsplit(url)
+            path = parts.path or '/'
+            if parts.query:
+                path += '?' + parts.query
+            response, body = self.request(parts.scheme, parts.netloc, path)
+            location = response.getheader('location')
+            if response.status in REDIRECTS and location:
+                url = urlparse.urljoin(url, location)
+                continue
+            if response.status >= 400:
+                raise urllib2.HTTPError(
+                    url, response.status, response.reason,
+                    response.msg, None)
+            return body
+        raise urllib2.HTTPError(url, response.status, 'Too many redirects',
+                                response.msg, None)
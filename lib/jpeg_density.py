@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+#
+
+import struct
+
+SOI = b'\xff\xd8'
+SOS = 0xda
+APP0 = 0xe0
+APP1 = 0xe1
+# markers without a length field
+STANDALONE = set([0x01, 0xd0, 0xd1, 0xd2, 0xd3, 0xd4, 0xd5, 0xd6, 0xd7])
+EXIF_RESOLUTION_UNIT = 0x0128
+EXIF_X_RESOLUTION = 0x011a
+
+
+def exif_dpi(data):
+    """
+    Density from the IFD0 of an Exif APP1 payload, rounded like Pillow.
+
+    Pillow falls back to 72 DPI when the tags are missing or broken.
+    """
+    tiff = data[6:]
+    if tiff[:2] == b'II':
+        order = '<'
+    elif tiff[:2] == b'MM':
+        order = '>'
+    else:
+        return 72, 72
+    try:
+        offset = struct.unpack_from(order + 'L', tiff, 4)[0]
+        count = struct.unpack_from(order + 'H', tiff, offset)[0]
+        tags = {}
+        for i in range(count):
+            tag, kind, n, value = struct.unpack_from(
+                order + 'HHL4s', tiff, offset + 2 + i * 12)
+            tags[tag] = kind, value
+        kind, value = tags[EXIF_RESOLUTION_UNIT]
+        unit = struct.unpack_from(order + 'H', value)[0]
+        kind, value = tags[EXIF_X_RESOLUTION]
+        if kind == 5:
+            num, den = struct.unpack_from(
+                order + 'LL', tiff, struct.unpack(order + 'L', value)[0])
+            dpi = float(num) / den
+        elif kind == 3:
+            dpi = struct.unpack_from(order + 'H', value)[0]
+        else:
+            dpi = struct.unpack(order + 'L', value)[0]
+    except (KeyError, struct.error, ZeroDivisionError):
+        return 72, 72
+    if unit == 3:
+        # dots per centimetre
+        dpi *= 2.54
+    return int(dpi + 0.5), int(dpi + 0.5)
+
+
+def jpeg_dpi(path, default=(96, 96)):
+    """
+    Return the density of the JPEG file at path, without decoding it.
+
+    Only the marker segments before the image data are read, usually a
+    few hundred bytes. A JFIF APP0 header in dots per inch wins over the
+    Exif resolution, as it does in Pillow's info['dpi']; default is
+    returned when neither is present. None means the file is not a
+    readable JPEG.
+    """
+    dpi = None
+    with open(path, 'rb') as f:
+        if f.read(2) != SOI:
+            return None
+        while True:
+            head = f.read(2)
+            if len(head) < 2 or head[0:1] != b'\xff':
+                return None
+            marker = ord(head[1:2])
+            if marker == 0xff:
+                # fill byte, the marker follows
+                f.seek(-1, 1)
+                continue
+            if marker in STANDALONE:
+                continue
+            if marker == SOS:
+                break
+            size = f.read(2)
+            if len(size) < 2:
+                return None
+            size = struct.unpack('>H', size)[0] - 2
+            if size < 0:
+                return None
+            if marker == APP0:
+                data = f.read(size)
+                if data[:4] == b'JFIF' and len(data) >= 12:
+                    unit = ord(data[7:8])
+                    if unit == 1:
+                        return struct.unpack('>HH', data[8:12])
+            elif marker == APP1 and dpi is None:
+                data = f.read(size)
+                if data[:6] == b'Exif\x00\x00':
+                    dpi = exif_dpi(data)
+            else:
+                f.seek(size, 1)
+    if dpi is None:
+        return default
+    return dpi
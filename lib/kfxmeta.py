@@ -3,12 +3,14 @@
 
 # python 2.7
 from __future__ import (unicode_literals, division, absolute_import, print_function)
+import binascii
+import codecs
 import collections
 import datetime
 import decimal
+import hashlib
 import json
 import os
-import StringIO
 import struct
 
 
@@ -121,6 +123,28 @@ YJ_SYMBOLS = {
     
     
 METADATA_ENTITY_TYPES = {164, 258, 417, 490}
+RAW_MEDIA_ENTITY_TYPE = 417
+
+# metadata needed to find the document type, ASIN and cover of a book
+COVER_METADATA_FIELDS = ("cde_content_type", "ASIN", "cover_image")
+
+# CONT magic, version, header length, container info offset and length
+CONTAINER_HEADER_LEN = 18
+
+# entity index table entry: id, type, offset, length
+ENTITY_INDEX_ENTRY = struct.Struct(b'<LLQQ')
+
+DOUBLE = struct.Struct(b'>d')
+UNSIGNED_INTS = {1: struct.Struct(b'>B'), 2: struct.Struct(b'>H'), 4: struct.Struct(b'>L'), 8: struct.Struct(b'>Q')}
+DECIMAL_POWERS = {}
+utf8_decode = codecs.utf_8_decode
+
+# zero-copy slice of a byte string
+try:
+    data_view = buffer
+except NameError:
+    def data_view(data, offset, size):
+        return memoryview(data)[offset:offset + size]
 
 
 def main():
@@ -148,7 +172,7 @@ def main():
         for fn in sorted(os.listdir(args.pathname)):
             if fn.endswith('.kfx'):
                 try:
-                    metadata = get_kindle_kfx_metadata(os.path.join(args.pathname, fn))
+                    metadata = get_kindle_kfx_metadata(os.path.join(args.pathname, fn), fields=COVER_METADATA_FIELDS)
                     #print('%s: %s' % (fn, ', '.join(['%s=%s' % i for i in sorted(metadata.items()) if type(i[1]) is not str])))
                     print('%s: doctype=%s, asin=%s, cover=%s' % (fn, metadata.get("cde_content_type"),
                                 metadata.get("ASIN"), "cover_image_data" in metadata))
@@ -164,16 +188,16 @@ def main():
         print('Odkodowanie: %s' % args.pathname)
         
         if args.pathname.endswith('.kdf'):
-            data = KDFDatabase(args.pathname).decode()
+            data = KDFDatabase(args.pathname).decode(metadata_only=args.metadata)
         else:
             packed_data = read_file(args.pathname)
             
             if packed_data[0:4] == CONTAINER_MAGIC:
                 data = KFXContainer(packed_data).decode(metadata_only=args.metadata)
             elif packed_data[0:4] == ION_MAGIC:
-                data = PackedIon(packed_data).decode_list()
+                data = IonDecoder(packed_data).decode_list()
             elif packed_data[0:8] == DRMION_MAGIC:
-                data = PackedIon(packed_data[8:-8]).decode_list()
+                data = IonDecoder(packed_data[8:-8]).decode_list()
             else:
                 print('%s nie wydaje się być KFX, KDF lub ION' % args.pathname)
                 return
@@ -189,25 +213,56 @@ def main():
         print('No processing option specified. See --help')
 
     
-def get_kindle_kfx_metadata(filepath):
-    packed_data = read_file(filepath)
-
-    if packed_data[0:8] == DRMION_MAGIC:
-        # encrypted main file - metadata is in an alternate location
-        altpath = os.path.join(os.path.splitext(filepath)[0] + ".sdr", "assets", "metadata.kfx")
-        packed_data = read_file(altpath)
+def get_kindle_kfx_metadata(filepath, raw_binary=False, fields=None):
+    '''
+    Binary values, such as cover_image_data, are returned base64 encoded unless raw_binary is set,
+    in which case they are returned as byte strings.
+    
+    If fields is given, only those metadata keys are decoded and returned (cover_image_data is
+    returned when "cover_image" is among them), everything else in the metadata entities is skipped.
+    '''
+    # only the header of the (often large) main book file is read
+    with open(filepath, 'rb') as stream:
+        if stream.read(len(DRMION_MAGIC)) != DRMION_MAGIC:
+            return get_container_metadata(filepath, stream, raw_binary, fields)
             
-    if packed_data[0:4] != CONTAINER_MAGIC:
+    # encrypted main file - metadata is in an alternate location
+    altpath = os.path.join(os.path.splitext(filepath)[0] + ".sdr", "assets", "metadata.kfx")
+    
+    with open(altpath, 'rb') as stream:
+        return get_container_metadata(altpath, stream, raw_binary, fields)
+        
+
+def get_container_metadata(filepath, stream, raw_binary=False, fields=None):
+    stream.seek(0)
+    
+    if stream.read(len(CONTAINER_MAGIC)) != CONTAINER_MAGIC:
         raise Exception("%s is not a KFX container" % filepath)
         
-    return extract_metadata(KFXContainer(packed_data).decode(metadata_only=True))
+    paths = metadata_paths(fields) if fields is not None else None
+    return extract_metadata(KFXContainer(stream=stream).decode(metadata_only=True, raw_binary=raw_binary,
+                ordered=False, paths=paths), fields)
+                
+                
+def metadata_paths(fields):
+    '''
+    Symbol paths to decode from each metadata entity type to get the given metadata fields
+    '''
+    return {
+        490: [("categorised_metadata", "metadata", "key"), ("categorised_metadata", "metadata", "value")],
+        258: [(field,) for field in fields],
+        164: [("location",)],
+        }
 
     
     
-def extract_metadata(container_data):
+def extract_metadata(container_data, fields=None):
     metadata = {}
     
     def add_metadata(key, value):
+        if fields is not None and key not in fields:
+            return
+            
         if key == "author":
             # create additional "authors" metadata
             if "authors" not in metadata:
@@ -305,50 +360,148 @@ class PackedBlock(PackedData):
 class KFXContainer(PackedBlock):
     '''
     Container file containing data entities
+    
+    Either the whole file is passed in as data, or an open file as stream, in which case only
+    the header, container info, symbol table, index table and the entities actually opened are read.
     '''
     
-    def __init__(self, data):
+    def __init__(self, data=None, stream=None):
         self.data = data
-        PackedBlock.__init__(self, data, CONTAINER_MAGIC)
+        self.stream = stream
+        PackedBlock.__init__(self, self.read(0, CONTAINER_HEADER_LEN), CONTAINER_MAGIC)
         
         container_info_offset = self.unpack_one("<L")
         container_info_length = self.unpack_one("<L")
-        container_info = PackedIon(data[container_info_offset:container_info_offset + container_info_length]).decode()
+        container_info = IonDecoder(self.read(container_info_offset, container_info_length)).decode()
         
         doc_symbol_length = container_info.get("bcDocSymbolLength")
         
         if doc_symbol_length:
             doc_symbol_offset = container_info["bcDocSymbolOffset"]
-            self.symbol_data = data[doc_symbol_offset:doc_symbol_offset + doc_symbol_length]
+            self.symbol_data = self.read(doc_symbol_offset, doc_symbol_length)
         else:
             self.symbol_data = None
             
             
-        self.entities = []
+        # the index table is kept packed, entities are opened on demand
         index_table_length = container_info.get("bcIndexTabLength")
         
         if index_table_length:
             index_table_offset = container_info["bcIndexTabOffset"]
-            entity_table = PackedData(data[index_table_offset:index_table_offset + index_table_length])
+            self.index_table = self.read(index_table_offset, index_table_length)
+            self.entity_count = index_table_length // ENTITY_INDEX_ENTRY.size
+        else:
+            self.index_table = None
+            self.entity_count = 0
+            
+            
+    def read(self, offset, size):
+        if self.stream is not None:
+            self.stream.seek(offset)
+            return self.stream.read(size)
+            
+        return data_view(self.data, offset, size)
+        
+        
+    def entity_info(self, index):
+        '''
+        Return (id, type, offset, length) of an entity without opening it
+        '''
+        return ENTITY_INDEX_ENTRY.unpack_from(self.index_table, index * ENTITY_INDEX_ENTRY.size)
         
-            while entity_table.remaining():
-                entity_id, entity_type, entity_offset, entity_len = entity_table.unpack_multi('<LLQQ')
-                entity_start = self.header_len + entity_offset
-                self.entities.append(Entity(self.data[entity_start:entity_start + entity_len], entity_type, entity_id))
+        
+    def entity(self, index):
+        entity_id, entity_type, entity_offset, entity_len = self.entity_info(index)
+        entity_start = self.header_len + entity_offset
+        return Entity(self.read(entity_start, entity_len), entity_type, entity_id)
+        
+        
+    @property
+    def entities(self):
+        return [self.entity(i) for i in range(self.entity_count)]
             
         
-    def decode(self, metadata_only=False):
-        symtab = dict(YJ_SYMBOLS)
+    def decode(self, metadata_only=False, raw_binary=False, ordered=True, paths=None):
+        '''
+        paths optionally maps entity types to the symbol paths to decode from them, see IonDecoder.decode
+        '''
+        symtab = SYMBOL_TABLES.get(self.symbol_data)
+        result = []
+        names = IonDecoder(b'', symtab)
+        
+        for i in range(self.entity_count):
+            entity_id, entity_type = self.entity_info(i)[:2]
+            
+            if metadata_only:
+                if entity_type not in METADATA_ENTITY_TYPES:
+                    continue
+                    
+                if entity_type == RAW_MEDIA_ENTITY_TYPE:
+                    # only the one resource the cover refers to is ever read
+                    result.append(LazyTypedData(names.symbol_name(entity_type), names.symbol_name(entity_id),
+                                    lambda i=i: self.entity(i).decode(symtab, raw_binary, ordered).value))
+                    continue
+                    
+            result.append(self.entity(i).decode(symtab, raw_binary, ordered, paths.get(entity_type) if paths else None))
+            
+        return result
+        
+
+class SymbolTable(dict):
+    '''
+    Read-only symbol table, shared by every container using the same local symbols
+    '''
     
-        if self.symbol_data:
-            ion_symbol_table = PackedIon(self.symbol_data).decode().value
-            syms = ion_symbol_table["symbols"]
-            min_id = ion_symbol_table["max_id"] - len(syms) + 1
+    def __readonly(self, *args, **kwargs):
+        raise TypeError('symbol tables are shared and cannot be modified')
+        
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = __readonly
+    
+    
+class SymbolTableCache(object):
+    '''
+    Symbol tables keyed by a hash of the container's bcDocSymbol data
+    
+    Books produced by the same tools carry identical local symbol tables, so after the first one
+    the table is looked up instead of decoded. hits and misses count the lookups.
+    '''
+    
+    def __init__(self, max_entries=64):
+        self.max_entries = max_entries
+        self.tables = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        
+        
+    def get(self, symbol_data):
+        if not symbol_data:
+            return YJ_SYMBOL_TABLE
+            
+        key = hashlib.sha1(symbol_data).digest()
+        symtab = self.tables.pop(key, None)
+        
+        if symtab is None:
+            self.misses += 1
+            symtab = self.decode(symbol_data)
+            if len(self.tables) >= self.max_entries:
+                self.tables.popitem(last=False)
+        else:
+            self.hits += 1
             
-            for i,sym in enumerate(syms):
-                symtab[i + min_id] = sym
+        self.tables[key] = symtab
+        return symtab
+        
+        
+    def decode(self, symbol_data):
+        symtab = dict(YJ_SYMBOLS)
+        ion_symbol_table = IonDecoder(symbol_data).decode().value
+        syms = ion_symbol_table["symbols"]
+        min_id = ion_symbol_table["max_id"] - len(syms) + 1
+        
+        for i,sym in enumerate(syms):
+            symtab[i + min_id] = sym
             
-        return [entity.decode(symtab) for entity in self.entities if (not metadata_only) or (entity.entity_type in METADATA_ENTITY_TYPES)]
+        return SymbolTable(symtab)
         
 
 class TypedData(object):
@@ -358,6 +511,26 @@ class TypedData(object):
         self.value = value
         
 
+class LazyTypedData(TypedData):
+    '''
+    TypedData whose value is decoded on first access
+    '''
+    
+    def __init__(self, type_, id, load):
+        self.type = type_
+        self.id = id
+        self.load = load
+        
+        
+    @property
+    def value(self):
+        if self.load is not None:
+            self._value = self.load()
+            self.load = None
+            
+        return self._value
+        
+
 class Entity(PackedBlock):
     '''
     Data entity inside a container
@@ -371,49 +544,96 @@ class Entity(PackedBlock):
             self.entity_data = entity_data
         else:
             PackedBlock.__init__(self, data, ENTITY_MAGIC)
-            self.entity_data = data[self.header_len:]
+            self.entity_data = data_view(data, self.header_len, len(data) - self.header_len)
         
         
-    def decode(self, symtab):
-        return TypedData(PackedIon(symtab=symtab).symbol_name(self.entity_type),
-                    PackedIon(symtab=symtab).symbol_name(self.entity_id),
-                    PackedIon(self.entity_data, symtab).decode() if PackedData(self.entity_data).unpack_one('4s') == ION_MAGIC
-                            else self.entity_data.encode('base64'))
+    def decode(self, symtab, raw_binary=False, ordered=True, paths=None):
+        if PackedData(self.entity_data).unpack_one('4s') == ION_MAGIC:
+            value = IonDecoder(self.entity_data, symtab, raw_binary, ordered).decode(paths)
+        elif raw_binary:
+            value = bytes(self.entity_data)
+        else:
+            value = bytes(self.entity_data).encode('base64')
+            
+        names = IonDecoder(b'', symtab)
+        return TypedData(names.symbol_name(self.entity_type), names.symbol_name(self.entity_id), value)
     
 
 class KDFDatabase(object):
     '''
     SLQite database containing book fragments
+    
+    Fragments are read through a cursor one at a time and decoded straight from the blob returned
+    by SQLite, so memory use does not grow with the number of fragments.
     '''
     
+    METADATA_FRAGMENT_IDS = ("book_metadata", "metadata")
+    
     def __init__(self, filename):
-        import sqlite3      # version 3.8.2 or later required
+        self.filename = filename
         
-        conn = sqlite3.connect(filename, 30)
-        self.fragments = conn.execute('SELECT * FROM fragments;').fetchall()
-        conn.close()
         
+    def query(self, sql, params=()):
+        import sqlite3      # version 3.8.2 or later required
         
-    def decode(self):
-        fragments_data = []
-        
-        for id, payload_type, payload_value in self.fragments:
+        conn = sqlite3.connect(self.filename, 30)
+        try:
+            for row in conn.execute(sql, params):
+                yield row
+        finally:
+            conn.close()
+            
+            
+    def iter_fragments(self, ids=None, raw_binary=False):
+        '''
+        Yield decoded fragments, all of them or only those with the given ids
+        '''
+        if ids is None:
+            rows = self.query('SELECT id, payload_type, payload_value FROM fragments;')
+        else:
+            ids = list(ids)
+            rows = self.query('SELECT id, payload_type, payload_value FROM fragments WHERE id IN (%s);' %
+                        ', '.join('?' * len(ids)), ids)
+            
+        for id, payload_type, payload_value in rows:
             if payload_type == "blob" and id != "max_id":
-                fragment = PackedIon(StringIO.StringIO(payload_value).read()).decode()
-                fragments_data.append(TypedData(fragment.id, id.encode('utf8'), fragment.value))
-      
+                fragment = IonDecoder(payload_value, raw_binary=raw_binary).decode()
+                yield TypedData(fragment.id, id.encode('utf8'), fragment.value)
+                
+                
+    def decode(self, metadata_only=False, raw_binary=False):
+        if not metadata_only:
+            return list(self.iter_fragments(raw_binary=raw_binary))
+            
+        # book metadata first, then only the fragments the cover refers to
+        fragments_data = list(self.iter_fragments(self.METADATA_FRAGMENT_IDS, raw_binary))
+        cover_image = extract_metadata(fragments_data).get("cover_image")
+        
+        if cover_image:
+            resources = list(self.iter_fragments([cover_image], raw_binary))
+            locations = [fragment.value.get("location") for fragment in resources
+                            if fragment.type == "external_resource" and isinstance(fragment.value, dict)]
+            
+            if any(locations):
+                resources.extend(self.iter_fragments([location for location in locations if location], raw_binary))
+                
+            fragments_data.extend(resources)
+            
         return fragments_data
         
         
 
 class PackedIon(PackedData):
     '''
-    Packed structured binary data format
+    Packed structured binary data format (reference decoder, IonDecoder is the fast one)
+    
+    Blobs are decoded to base64 text, or left as byte strings if raw_binary is set.
     '''
     
-    def __init__(self, data=b'', symtab=YJ_SYMBOLS):
+    def __init__(self, data=b'', symtab=YJ_SYMBOLS, raw_binary=False):
         PackedData.__init__(self, data)
         self.symtab = symtab
+        self.raw_binary = raw_binary
 
         
     def decode(self):
@@ -459,13 +679,13 @@ class PackedIon(PackedData):
 
         if data_type == DT_DECIMAL:
             if data_len == 0: return decimal.Decimal(0)
-            ion = PackedIon(self.extract(data_len), self.symtab)
+            ion = PackedIon(self.extract(data_len), self.symtab, self.raw_binary)
             scale = ion.unpack_signed_number()
             magnitude = ion.unpack_signed_int(ion.remaining())
             return decimal.Decimal(magnitude) * (decimal.Decimal(10) ** scale)
         
         if data_type == DT_TIMESTAMP:
-            ion = PackedIon(self.extract(data_len), self.symtab)
+            ion = PackedIon(self.extract(data_len), self.symtab, self.raw_binary)
             ion.unpack_unsigned_number()        # unknown
             year = ion.unpack_unsigned_number()
             month = ion.unpack_unsigned_number()
@@ -486,6 +706,8 @@ class PackedIon(PackedData):
             return self.extract(data_len).decode('utf8')
         
         if data_type == DT_BLOB:
+            if self.raw_binary:
+                return self.extract(data_len)
             return self.extract(data_len).encode('base64')
         
         if data_type == DT_LIST:
@@ -495,7 +717,7 @@ class PackedIon(PackedData):
             return tuple(self.unpack_list(data_len))
             
         if data_type == DT_STRUCT:
-            ion = PackedIon(self.extract(data_len), self.symtab)
+            ion = PackedIon(self.extract(data_len), self.symtab, self.raw_binary)
             result = collections.OrderedDict()
             
             while (ion.remaining()):
@@ -505,7 +727,7 @@ class PackedIon(PackedData):
             return result
             
         if data_type == DT_TYPED_DATA:
-            ion = PackedIon(self.extract(data_len), self.symtab)
+            ion = PackedIon(self.extract(data_len), self.symtab, self.raw_binary)
             type_ = self.symbol_name(ion.unpack_unsigned_number())
             id = self.symbol_name(ion.unpack_unsigned_number())
             value = ion.unpack_typed_value()
@@ -518,7 +740,7 @@ class PackedIon(PackedData):
         
      
     def unpack_list(self, length):
-        ion = PackedIon(self.extract(length), self.symtab)
+        ion = PackedIon(self.extract(length), self.symtab, self.raw_binary)
         result = []
         
         while (ion.remaining()):
@@ -565,8 +787,271 @@ class PackedIon(PackedData):
     def symbol_name(self, symbol_number):
         return self.symtab.get(symbol_number, "S%d" % symbol_number)
         
+
+
+class IonDecoder(object):
+    '''
+    Fast decoder for packed ION data, producing the same values as PackedIon
+    
+    All values are decoded in place from one shared buffer by following offsets, with no
+    intermediate objects or copies for nested structures. If ordered is False, structs are
+    decoded to plain dicts instead of OrderedDicts.
+    '''
+    
+    def __init__(self, data, symtab=YJ_SYMBOLS, raw_binary=False, ordered=True):
+        self.data = data
+        self.symtab = symtab
+        self.raw_binary = raw_binary
+        self.struct_type = collections.OrderedDict if ordered else dict
+        
+        
+    def decode(self, paths=None):
+        '''
+        Decode the value, or if paths is given only the parts of it on those symbol paths
+        
+        A path is a sequence of struct field names, lists on the way are followed into every element.
+        Struct fields not on any path are skipped using their length, without being decoded.
+        '''
+        self.check_magic()
+        
+        if paths is not None:
+            return self.unpack_selected_value(len(ION_MAGIC), path_tree(paths))[0]
+            
+        return self.unpack_typed_value(len(ION_MAGIC))[0]
+        
+        
+    def decode_list(self):
+        self.check_magic()
+        return self.unpack_values(len(ION_MAGIC), len(self.data))
+        
+        
+    def check_magic(self):
+        magic = self.data[0:len(ION_MAGIC)]
+        if magic != ION_MAGIC:
+            raise Exception('ION magic number is incorrect (%s)' % hexs(magic))
+            
+            
+    def unpack_typed_value(self, offset):
+        # returns the value and the offset following it
+        data = self.data
+        cmd = ord(data[offset])
+        offset += 1
+        
+        data_type = cmd >> 4
+        data_len = cmd & 0x0f
+        if data_len == 14: data_len, offset = self.unpack_unsigned_number(offset)
+        
+        end = offset + data_len
+        
+        if data_type == DT_STRUCT:
+            symtab = self.symtab
+            result = self.struct_type()
+            
+            while offset < end:
+                symbol, offset = self.unpack_unsigned_number(offset)
+                name = symtab.get(symbol)
+                if name is None: name = "S%d" % symbol
+                result[name], offset = self.unpack_typed_value(offset)
+                
+            return result, end
+            
+        if data_type == DT_STRING or data_type == DT_CLOB:
+            return utf8_decode(data[offset:end])[0], end
+            
+        if data_type == DT_SYMBOL:
+            return self.symbol_name(self.unpack_unsigned_int(offset, data_len)), end
+            
+        if data_type == DT_POSITIVE_INTEGER:
+            return self.unpack_unsigned_int(offset, data_len), end
+            
+        if data_type == DT_LIST:
+            return self.unpack_values(offset, end), end
+            
+        if data_type == DT_NULL:
+            return None, offset
+            
+        if data_type == DT_BOOLEAN:
+            return data_len != 0, offset  # length is actually value
+            
+        if data_type == DT_NEGATIVE_INTEGER:
+            return -self.unpack_unsigned_int(offset, data_len), end
+            
+        if data_type == DT_FLOAT:
+            if data_len == 0: return float(0.0), end
+            return DOUBLE.unpack_from(data, offset)[0], end     # length must be 8
+            
+        if data_type == DT_DECIMAL:
+            if data_len == 0: return decimal.Decimal(0), end
+            scale = self.unpack_signed_number(offset)
+            magnitude = self.unpack_signed_int(offset + 1, data_len - 1)
+            power = DECIMAL_POWERS.get(scale)
+            if power is None: power = DECIMAL_POWERS[scale] = decimal.Decimal(10) ** scale
+            return decimal.Decimal(magnitude) * power, end
+            
+        if data_type == DT_TIMESTAMP:
+            fields = []
+            offset = self.unpack_unsigned_number(offset)[1]     # unknown
+            for i in range(6):
+                value, offset = self.unpack_unsigned_number(offset)
+                fields.append(value)
+            return datetime.datetime(*fields), end
+            
+        if data_type == DT_BLOB:
+            if self.raw_binary:
+                return data[offset:end], end
+            return data[offset:end].encode('base64'), end
+            
+        if data_type == DT_S_EXPRESSION:
+            return tuple(self.unpack_values(offset, end)), end
+            
+        if data_type == DT_TYPED_DATA:
+            type_, offset = self.unpack_unsigned_number(offset)
+            id, offset = self.unpack_unsigned_number(offset)
+            value = self.unpack_typed_value(offset)[0]
+            return TypedData(self.symbol_name(type_), self.symbol_name(id), value), end
+            
+        print("Nieznany typ danych %d" % data_type)
+        return None, end
+        
+        
+    def unpack_selected_value(self, offset, wanted):
+        # like unpack_typed_value, keeping only the struct fields in the wanted path tree
+        data_type = ord(self.data[offset]) >> 4
+        
+        if data_type not in (DT_STRUCT, DT_LIST, DT_S_EXPRESSION, DT_TYPED_DATA):
+            return self.unpack_typed_value(offset)
+            
+        data_len = ord(self.data[offset]) & 0x0f
+        offset += 1
+        if data_len == 14: data_len, offset = self.unpack_unsigned_number(offset)
+        
+        end = offset + data_len
+        
+        if data_type == DT_STRUCT:
+            result = self.struct_type()
+            
+            while offset < end:
+                symbol, offset = self.unpack_unsigned_number(offset)
+                name = self.symbol_name(symbol)
+                
+                if name not in wanted:
+                    offset = self.skip_value(offset)
+                elif wanted[name] is None:
+                    result[name], offset = self.unpack_typed_value(offset)
+                else:
+                    result[name], offset = self.unpack_selected_value(offset, wanted[name])
+                    
+            return result, end
+            
+        if data_type == DT_TYPED_DATA:
+            type_, offset = self.unpack_unsigned_number(offset)
+            id, offset = self.unpack_unsigned_number(offset)
+            value = self.unpack_selected_value(offset, wanted)[0]
+            return TypedData(self.symbol_name(type_), self.symbol_name(id), value), end
+            
+        result = []
+        
+        while offset < end:
+            value, offset = self.unpack_selected_value(offset, wanted)
+            result.append(value)
+            
+        return (tuple(result) if data_type == DT_S_EXPRESSION else result), end
+        
+        
+    def skip_value(self, offset):
+        # offset following the value, found from its length alone
+        cmd = ord(self.data[offset])
+        offset += 1
+        
+        data_len = cmd & 0x0f
+        if data_len == 14: data_len, offset = self.unpack_unsigned_number(offset)
+        
+        if (cmd >> 4) in (DT_NULL, DT_BOOLEAN):
+            return offset
+            
+        return offset + data_len
+        
+        
+    def unpack_values(self, offset, end):
+        result = []
+        
+        while offset < end:
+            value, offset = self.unpack_typed_value(offset)
+            result.append(value)
+            
+        return result
+        
+        
+    def unpack_unsigned_number(self, offset):
+        # variable length numbers, MSB first, 7 bits per byte, last byte is flagged by MSb set
+        data = self.data
+        number = 0
+        while True:
+            byte = ord(data[offset])
+            offset += 1
+            number = (number << 7) | (byte & 0x7f)
+            if byte >= 0x80:
+                return number, offset
+                
+                
+    def unpack_signed_number(self, offset):
+        # single byte only, variable length not supported
+        value = ord(self.data[offset])
+        if (value & 0x80) == 0: raise Exception('encountered multi-byte signed number')
+        if (value & 0x40): return -(value & 0x3f)
+        return (value & 0x7f)
+        
+        
+    def unpack_unsigned_int(self, offset, length):
+        # unsigned big-endian (MSB first)
+        unpacker = UNSIGNED_INTS.get(length)
+        if unpacker is not None:
+            return unpacker.unpack_from(self.data, offset)[0]
+            
+        if length == 0: return 0
+        return int(binascii.hexlify(self.data[offset:offset + length]), 16)
+        
+        
+    def unpack_signed_int(self, offset, length):
+        # signed big-endian (MSB first)
+        if length == 0: return 0
+        
+        first_byte = ord(self.data[offset])
+        if (first_byte & 0x80) != 0:
+            return -(((first_byte & 0x7f) << (8 * (length - 1))) + self.unpack_unsigned_int(offset + 1, length - 1))
+            
+        return self.unpack_unsigned_int(offset, length)
+        
+        
+    def symbol_name(self, symbol_number):
+        return self.symtab.get(symbol_number, "S%d" % symbol_number)
+        
     
 
+def path_tree(paths):
+    '''
+    Merge symbol paths into nested dicts, None marks a field wanted whole
+    '''
+    tree = {}
+    
+    for path in paths:
+        node = tree
+        
+        for name in path[:-1]:
+            if name in node and node[name] is None:
+                break
+                
+            node = node.setdefault(name, {})
+        else:
+            node[path[-1]] = None
+            
+    return tree
+    
+
+YJ_SYMBOL_TABLE = SymbolTable(YJ_SYMBOLS)
+SYMBOL_TABLES = SymbolTableCache()
+
+
 def hexs(string, sep=' '):
     return sep.join('%02x' % ord(b) for b in string)
     
@@ -579,7 +1064,7 @@ class IonEncoder(json.JSONEncoder):
         if type(o).__name__ == "datetime":
             return o.isoformat()
             
-        if type(o).__name__ == "TypedData":
+        if isinstance(o, TypedData):
             return {"type": o.type, "id": o.id, "value": o.value}
             
         return super(IonEncoder, self).default(o)
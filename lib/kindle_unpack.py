@@ -1,23 +1,67 @@
 # -*- coding: utf-8 -*-
 #
 
+import mmap
+import os
 import struct
 
+try:
+    _view = buffer
+except NameError:
+    def _view(data, offset, size):
+        return memoryview(data)[offset:offset + size]
+
 
 class Sectionizer:
-    def __init__(self, filename):
-        self.data = open(filename, 'rb').read()
+    def __init__(self, filename, data=None, use_mmap=False):
+        self.stream = None
+        self.mapped = False
+        if data is None and use_mmap:
+            self.stream = open(filename, 'rb')
+            try:
+                data = mmap.mmap(self.stream.fileno(), 0,
+                                 access=mmap.ACCESS_READ)
+                self.mapped = True
+            except (ValueError, EnvironmentError):
+                # empty files and some network filesystems cannot be mapped
+                data = self.stream.read()
+                self.stream.close()
+                self.stream = None
+        elif data is None:
+            data = open(filename, 'rb').read()
+        self.data = data
         self.palmheader = self.data[:78]
         self.palmname = self.data[:32]
         self.ident = self.palmheader[0x3C:0x3C + 8]
-        self.num_sections, = struct.unpack_from('>H', self.palmheader, 76)
         self.filelength = len(self.data)
-        sectionsdata = struct.unpack_from('>%dL' % (self.num_sections * 2), self.data, 78) + (self.filelength, 0)  # noqa
+        try:
+            self.num_sections, = struct.unpack_from('>H', self.palmheader, 76)
+            self.parse_section_table(self.data, 78)
+        except struct.error:
+            self.close()
+            raise
+        return
+
+    def parse_section_table(self, table, offset=0):
+        sectionsdata = struct.unpack_from('>%dL' % (self.num_sections * 2), table, offset) + (self.filelength, 0)  # noqa
         self.sectionoffsets = sectionsdata[::2]
         self.sectionattributes = sectionsdata[1::2]
         self.sectiondescriptions = ["" for x in range(self.num_sections + 1)]
         self.sectiondescriptions[-1] = "File Length Only"
-        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self.mapped:
+            self.data.close()
+            self.mapped = False
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
 
     def setsectiondescription(self, section, description):
         if section < len(self.sectiondescriptions):
@@ -29,9 +73,64 @@ class Sectionizer:
 
     def load_section(self, section):
         before, after = self.sectionoffsets[section:section + 2]
+        if self.mapped:
+            # zero-copy view, only the pages actually read are faulted in
+            return _view(self.data, before, after - before)
         return self.data[before:after]
 
 
+class SeekSectionizer(Sectionizer):
+    """
+    Sectionizer that reads only what is asked for.
+
+    The PDB header and the section table are fetched with two reads and
+    every loaded section costs one seek and one read, so getting record 0
+    and a single image never touches the rest of the file. Record 0 is
+    kept after the first load, sections read early with prefetch() are
+    kept until they are loaded. bytes_read and reads count the I/O done.
+    """
+
+    def __init__(self, filename):
+        self.stream = open(filename, 'rb')
+        self.mapped = False
+        self.data = None
+        self.bytes_read = 0
+        self.reads = 0
+        self.cache = {}
+        try:
+            self.palmheader = self.read_at(0, 78)
+            self.palmname = self.palmheader[:32]
+            self.ident = self.palmheader[0x3C:0x3C + 8]
+            self.filelength = os.fstat(self.stream.fileno()).st_size
+            self.num_sections, = struct.unpack_from('>H', self.palmheader, 76)
+            self.parse_section_table(
+                self.read_at(78, self.num_sections * 8))
+        except struct.error:
+            self.close()
+            raise
+
+    def read_at(self, offset, size):
+        self.stream.seek(offset)
+        data = self.stream.read(size)
+        self.bytes_read += len(data)
+        self.reads += 1
+        return data
+
+    def prefetch(self, sections):
+        for section in sections:
+            if section not in self.cache:
+                self.cache[section] = self.load_section(section)
+
+    def load_section(self, section):
+        data = self.cache.pop(section, None)
+        if data is None:
+            before, after = self.sectionoffsets[section:section + 2]
+            data = self.read_at(before, after - before)
+        if section == 0:
+            self.cache[0] = data
+        return data
+
+
 class MobiHeader:
     id_map_hexstrings = {
         209: 'Tamper Proof Keys (hex)',
@@ -118,7 +217,8 @@ class MobiHeader:
         self.metadata = {}
         self.sect = sect
         self.start = sectnumber
-        self.header = self.sect.load_section(self.start)
+        # copy record 0 so the header does not pin a memory-mapped file
+        self.header = bytes(self.sect.load_section(self.start))
         if len(self.header) > 20 and self.header[16:20] == b'MOBI':
             self.sect.setsectiondescription(0, b"Mobipocket Header")
             self.palm = False
@@ -151,7 +251,7 @@ class MobiHeader:
         self.dividx = 0xffffffff
         self.othidx = 0xffffffff
         self.fdst = 0xffffffff
-        self.mlstart = self.sect.load_section(self.start + 1)[:4]
+        self.mlstart = bytes(self.sect.load_section(self.start + 1)[:4])
 
         if self.palm:
             return
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+#
+
+import os
+import time
+from datetime import date
+from datetime import timedelta
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+BOOK_EXTENSIONS = ('.azw', '.azw3', '.mobi', '.kfx', '.azw8')
+# directories under documents never holding books to process
+PRUNED_DIRS = ('dictionaries',)
+SIDECAR_SUFFIX = '.sdr'
+
+
+class BookFile(object):
+    """A book found on the device, with the stat result of the scan."""
+
+    __slots__ = ('path', 'root', 'name', 'st', 'has_sidecar')
+
+    def __init__(self, path, root, name, st, has_sidecar):
+        self.path = path
+        self.root = root
+        self.name = name
+        self.st = st
+        self.has_sidecar = has_sidecar
+
+
+class _DirEntry(object):
+    """Stand-in for scandir entries when no scandir is available."""
+
+    __slots__ = ('name', 'path', '_st')
+
+    def __init__(self, root, name):
+        self.name = name
+        self.path = os.path.join(root, name)
+        self._st = None
+
+    def stat(self):
+        if self._st is None:
+            self._st = os.stat(self.path)
+        return self._st
+
+    def is_dir(self):
+        try:
+            return os.path.isdir(self.path)
+        except OSError:
+            return False
+
+
+def list_dir(path):
+    if scandir is not None:
+        return scandir(path)
+    return [_DirEntry(path, name) for name in os.listdir(path)]
+
+
+def days_cutoff(days):
+    """Epoch of the local midnight starting the oldest day within days."""
+    if days is None:
+        return None
+    day = date.today() - timedelta(int(days))
+    return time.mktime(day.timetuple())
+
+
+def scan_library(docs, extensions=BOOK_EXTENSIONS, cutoff=None,
+                 pruned=PRUNED_DIRS):
+    """
+    Return the books under docs as a list of BookFile, in os.walk order.
+
+    The pruned directories right under docs, dictionaries by default,
+    and .sdr sidecar directories are skipped without being listed. With
+    cutoff, an epoch, only books changed (ctime) since then are
+    returned. Directory entries come from scandir, so on Windows the
+    stat results come with the listing.
+    """
+    books = []
+    try:
+        entries = list(list_dir(docs))
+    except OSError:
+        return books
+    files = []
+    dirs = []
+    sidecars = set()
+    for entry in entries:
+        if entry.is_dir():
+            if entry.name.lower().endswith(SIDECAR_SUFFIX):
+                sidecars.add(entry.name[:-len(SIDECAR_SUFFIX)])
+            elif entry.name.lower() not in pruned:
+                dirs.append(entry)
+        elif entry.name.lower().endswith(extensions):
+            files.append(entry)
+    for entry in files:
+        try:
+            st = entry.stat()
+        except OSError:
+            continue
+        if cutoff is not None and st.st_ctime < cutoff:
+            continue
+        books.append(BookFile(
+            entry.path, docs, entry.name, st,
+            os.path.splitext(entry.name)[0] in sidecars))
+    for entry in dirs:
+        books.extend(scan_library(entry.path, extensions, cutoff, ()))
+    return books
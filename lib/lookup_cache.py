@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+#
+
+import json
+import sqlite3
+import threading
+import time
+
+DAY = 24 * 60 * 60
+
+
+def normalize(text):
+    """Cache key form of a title or author: lower case, single spaces."""
+    return ' '.join(text.decode('utf-8').lower().split()).encode('utf-8')
+
+
+class LookupCache(object):
+    """
+    Persistent cache of page lookup results, safe to share by threads.
+
+    Values are stored as JSON under string keys. Found results are kept
+    for ttl seconds, results put with negative set, which found nothing,
+    for negative_ttl seconds so they are retried sooner. When more than
+    max_entries are stored, the least recently used ones are dropped on
+    close().
+    """
+
+    def __init__(self, filename, ttl=90 * DAY, negative_ttl=14 * DAY,
+                 max_entries=20000):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.hits = self.misses = 0
+        self.conn = sqlite3.connect(filename, check_same_thread=False)
+        self.conn.text_factory = str
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS lookups ('
+            'key TEXT PRIMARY KEY, value TEXT, expires INTEGER, '
+            'used INTEGER)'
+        )
+
+    def get(self, key, default=None):
+        now = int(time.time())
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT value FROM lookups WHERE key = ? AND expires > ?',
+                (key, now)).fetchone()
+            if row is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self.conn.execute('UPDATE lookups SET used = ? WHERE key = ?',
+                              (now, key))
+        return json.loads(row[0])
+
+    def put(self, key, value, negative=False):
+        now = int(time.time())
+        ttl = self.negative_ttl if negative else self.ttl
+        with self.lock:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO lookups (key, value, expires, used) '
+                'VALUES (?, ?, ?, ?)', (key, json.dumps(value), now + ttl, now)
+            )
+            self.conn.commit()
+
+    def evict(self):
+        """Drop expired entries and the least recently used extra ones."""
+        with self.lock:
+            self.conn.execute('DELETE FROM lookups WHERE expires <= ?',
+                              (int(time.time()),))
+            self.conn.execute(
+                'DELETE FROM lookups WHERE key IN (SELECT key FROM lookups '
+                'ORDER BY used DESC LIMIT -1 OFFSET ?)', (self.max_entries,))
+            self.conn.commit()
+
+    def close(self):
+        self.evict()
+        self.conn.close()
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+#
+
+from __future__ import print_function
+import os
+import struct
+
+from io import BytesIO
+
+import kindle_unpack
+from lib.header import PdbHeaderReader
+from lib.mobi_uncompress import text_reader
+from lib.mobi_uncompress import trailing_entries_size
+from lib.pages import find_exth
+from lib.pages import pages_row
+
+
+class MobiBook(object):
+    """
+    MOBI/AZW3 file read once and shared by every processing stage.
+
+    The parsed section table, MOBI header, EXTH metadata and page count
+    row are computed on first use and cached, so the CSV dump, cover,
+    AZW3 patch and APNX stages never go back to the device for them.
+
+    Unless the contents are passed in, mode selects how the file is read:
+    'seek' (default) fetches only the header, section table and the
+    records actually loaded, 'mmap' maps the file and 'read' loads it
+    whole.
+    """
+
+    def __init__(self, path, data=None, mode='seek'):
+        self.path = path
+        self.dirpath, self.name = os.path.split(path)
+        self._bytes_read = None
+        try:
+            if data is None and mode == 'seek':
+                self._section = kindle_unpack.SeekSectionizer(path)
+            else:
+                self._section = kindle_unpack.Sectionizer(
+                    path, data, mode == 'mmap')
+        except struct.error:
+            # too short to hold a PDB header and section table
+            self._section = None
+            self.data = None
+            self.ident = ''
+            self.acr = ''
+        else:
+            self.data = self._section.data
+            self.ident = self._section.ident
+            self.acr = str(PdbHeaderReader(
+                BytesIO(self._section.palmheader)).name())
+        self._mh = None
+        self._metadata = None
+        self._pages_row = None
+        self._has_pages_row = False
+
+    def is_mobi(self):
+        return self.ident == 'BOOKMOBI'
+
+    @property
+    def section(self):
+        return self._section
+
+    @property
+    def bytes_read(self):
+        return getattr(self._section, 'bytes_read', self._bytes_read)
+
+    @property
+    def mh(self):
+        if self._mh is None:
+            self._mh = kindle_unpack.MobiHeader(self.section, 0)
+        return self._mh
+
+    @property
+    def metadata(self):
+        if self._metadata is None:
+            self._metadata = self.mh.getmetadata()
+        return self._metadata
+
+    def exth_value(self, name):
+        try:
+            return self.metadata[name][0]
+        except (KeyError, IndexError):
+            return None
+
+    @property
+    def asin(self):
+        return self.exth_value('ASIN')
+
+    @property
+    def doctype(self):
+        return self.exth_value('Document Type')
+
+    @property
+    def version(self):
+        return self.mh.version
+
+    @property
+    def text_length(self):
+        return struct.unpack('>I', self.mh.header[4:8])[0]
+
+    @property
+    def extra_flags(self):
+        """Flags of the trailing entries appended to every text record."""
+        mh = self.mh
+        if mh.palm or mh.length < 0xE4 or mh.version < 5:
+            return 0
+        return struct.unpack_from('>H', mh.header, 0xF2)[0]
+
+    def text_records(self):
+        """
+        Yield the uncompressed text of the book one record at a time.
+
+        Only the record being decompressed is held in memory, so the
+        whole text can be walked at constant cost whatever its size.
+        A released book opens the file again for the time of the walk.
+        """
+        mh = self.mh
+        section = self._section
+        if section is None:
+            section = kindle_unpack.SeekSectionizer(self.path)
+        try:
+            reader = text_reader(mh, section)
+            extra_flags = self.extra_flags
+            for i in xrange(mh.start + 1, mh.start + 1 + mh.records):
+                data = section.load_section(i)
+                if extra_flags:
+                    data = data[:len(data) - trailing_entries_size(
+                        data, extra_flags)]
+                yield reader.unpack(data)
+        finally:
+            if section is not self._section:
+                section.close()
+
+    def cover_section(self):
+        """Section number of the cover according to EXTH CoverOffset."""
+        offset = self.exth_value('CoverOffset')
+        if offset is None or self.mh.firstresource == 0xffffffff:
+            return None
+        section = self.mh.firstresource + int(offset)
+        if section >= self.section.num_sections:
+            return None
+        return section
+
+    def preload(self):
+        """Read everything the cover stage needs, for read-ahead threads."""
+        if not self.is_mobi():
+            return self
+        try:
+            self.metadata
+            cover = self.cover_section()
+            if cover is not None and hasattr(self.section, 'prefetch'):
+                self.section.prefetch([cover])
+        except Exception:
+            # leave it to the consumer to report the broken book
+            pass
+        return self
+
+    def find_exth(self, search_id):
+        return find_exth(search_id, self.mh.header)
+
+    def pages_row(self):
+        if not self._has_pages_row:
+            self._pages_row = pages_row(self._section, self.name)
+            self._has_pages_row = True
+        return self._pages_row
+
+    def release(self):
+        """Drop the file contents, keeping parsed headers for later stages."""
+        if self._mh is not None:
+            self.metadata
+            self._mh.sect = None
+        if self._section is not None:
+            self._bytes_read = self.bytes_read
+            self._section.close()
+            self._section = None
+        self.data = None
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+#
+
+import re
+import struct
+
+# PalmDOC tokens: a run of literal bytes, a distance and length pair,
+# a space followed by a character, or 1 to 8 bytes copied as they are
+PALMDOC_TOKENS = re.compile(
+    b'[\x00\x09-\x7f]+|[\x80-\xbf][\x00-\xff]|[\xc0-\xff]|' +
+    b'|'.join(chr(n) + b'[\x00-\xff]{%d}' % n for n in range(1, 9)) +
+    b'|[\x01-\x08][\x00-\xff]*')
+PALMDOC_PAIRS = dict(
+    (chr(pair >> 8) + chr(pair & 0xff), ((pair & 0x3fff) >> 3, (pair & 7) + 3))
+    for pair in range(0x8000, 0xc000))
+PALMDOC_SPACES = dict(
+    (chr(c), b' ' + chr(c ^ 0x80)) for c in range(0xc0, 0x100))
+
+
+class UncompressedReader:
+    def unpack(self, data):
+        return bytes(data)
+
+
+class PalmdocReader:
+    """
+    PalmDOC LZ77 decompression of a single text record.
+
+    The record is split into tokens by one regular expression and the
+    pairs are looked up in a table, which leaves only the copying to
+    the loop.
+    """
+
+    def unpack(self, data):
+        out = bytearray()
+        pairs = PALMDOC_PAIRS.get
+        spaces = PALMDOC_SPACES.get
+        for token in PALMDOC_TOKENS.findall(bytes(data)):
+            pair = pairs(token)
+            if pair is not None:
+                distance, length = pair
+                start = len(out) - distance
+                if start < 0 or distance == 0:
+                    continue
+                if distance >= length:
+                    out += out[start:start + length]
+                else:
+                    # the copy overlaps itself and repeats its start
+                    out += (out[start:] * (length // distance + 1))[:length]
+            elif b'\x00' < token[0] < b'\x09':
+                out += token[1:]
+            else:
+                out += spaces(token, token)
+        return bytes(out)
+
+
+class HuffcdicReader:
+    """HUFF/CDIC decompression, set up from the HUFF and CDIC records."""
+
+    q = struct.Struct('>Q').unpack_from
+
+    def __init__(self):
+        self.dict1 = None
+        self.mincode = ()
+        self.maxcode = ()
+        self.dictionary = []
+
+    def load_huff(self, huff):
+        if huff[0:8] != b'HUFF\x00\x00\x00\x18':
+            raise ValueError('invalid HUFF header')
+        off1, off2 = struct.unpack_from('>LL', huff, 8)
+
+        def dict1_unpack(v):
+            codelen, term, maxcode = v & 0x1f, v & 0x80, v >> 8
+            if codelen == 0 or (codelen <= 8 and not term):
+                raise ValueError('invalid HUFF code table')
+            maxcode = ((maxcode + 1) << (32 - codelen)) - 1
+            return codelen, term, maxcode
+        self.dict1 = [dict1_unpack(v) for v in
+                      struct.unpack_from('>256L', huff, off1)]
+        dict2 = struct.unpack_from('>64L', huff, off2)
+        self.mincode = tuple(mincode << (32 - codelen) for codelen, mincode
+                             in enumerate((0,) + dict2[0::2]))
+        self.maxcode = tuple(((maxcode + 1) << (32 - codelen)) - 1
+                             for codelen, maxcode
+                             in enumerate((0,) + dict2[1::2]))
+
+    def load_cdic(self, cdic):
+        if cdic[0:8] != b'CDIC\x00\x00\x00\x10':
+            raise ValueError('invalid CDIC header')
+        phrases, bits = struct.unpack_from('>LL', cdic, 8)
+        n = min(1 << bits, phrases - len(self.dictionary))
+
+        def phrase(off):
+            blen, = struct.unpack_from('>H', cdic, 16 + off)
+            return cdic[18 + off:18 + off + (blen & 0x7fff)], blen & 0x8000
+        self.dictionary += [phrase(off) for off in
+                            struct.unpack_from('>%dH' % n, cdic, 16)]
+
+    def unpack(self, data):
+        q = HuffcdicReader.q
+        dict1 = self.dict1
+        mincode = self.mincode
+        dictionary = self.dictionary
+        bitsleft = len(data) * 8
+        data = bytes(data) + b'\x00' * 8
+        pos = 0
+        x, = q(data, pos)
+        n = 32
+        out = []
+        while True:
+            if n <= 0:
+                pos += 4
+                x, = q(data, pos)
+                n += 32
+            code = (x >> n) & 0xffffffff
+            codelen, term, maxcode = dict1[code >> 24]
+            if not term:
+                while code < mincode[codelen]:
+                    codelen += 1
+                maxcode = self.maxcode[codelen]
+            n -= codelen
+            bitsleft -= codelen
+            if bitsleft < 0:
+                break
+            r = (maxcode - code) >> (32 - codelen)
+            phrase, flag = dictionary[r]
+            if not flag:
+                # phrases are themselves compressed, expand once and keep
+                dictionary[r] = None
+                phrase = self.unpack(phrase)
+                dictionary[r] = (phrase, 1)
+            out.append(phrase)
+        return b''.join(out)
+
+
+def trailing_entries_size(data, extra_flags):
+    """Size of the trailing entries at the end of a text record."""
+    size = 0
+    flags = extra_flags >> 1
+    while flags:
+        if flags & 1:
+            num = 0
+            for v in data[max(len(data) - size - 4, 0):len(data) - size]:
+                v = ord(v)
+                if v & 0x80:
+                    num = 0
+                num = (num << 7) | (v & 0x7f)
+            size += num
+        flags >>= 1
+    if extra_flags & 1 and len(data) > size:
+        size += (ord(data[len(data) - size - 1]) & 0x3) + 1
+    return size
+
+
+def text_reader(mh, section):
+    """
+    Return the reader matching the compression of a MobiHeader.
+
+    HUFF/CDIC readers load their code tables from section.
+    """
+    compression, = struct.unpack_from('>H', mh.header, 0)
+    if compression == 1:
+        return UncompressedReader()
+    if compression == 2:
+        return PalmdocReader()
+    if compression == 17480:
+        reader = HuffcdicReader()
+        huffoff, huffnum = struct.unpack_from('>LL', mh.header, 0x70)
+        huffoff += mh.start
+        reader.load_huff(bytes(section.load_section(huffoff)))
+        for i in range(1, huffnum):
+            reader.load_cdic(bytes(section.load_section(huffoff + i)))
+        return reader
+    raise ValueError('unknown compression type %d' % compression)
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+#
+
+from __future__ import print_function
+import csv
+import os
+
+CSV_HEADER = ['asin', 'lang', 'author', 'title', 'pages', 'is_real',
+              'file_path']
+# what find_exth() returns for books without an ASIN
+NO_ASIN = '* BRAK *'
+
+
+def csv_reader(f):
+    return csv.reader(f, delimiter=';', quotechar='"',
+                      quoting=csv.QUOTE_ALL)
+
+
+def csv_writer(f):
+    return csv.writer(f, delimiter=';', quotechar='"',
+                      quoting=csv.QUOTE_ALL)
+
+
+def is_real(row):
+    """Whether the page count of row is real rather than estimated."""
+    return str(row[5]) == 'True'
+
+
+class PageDatabase(object):
+    """
+    Page counts of ect.csv, read once and indexed by ASIN and file name.
+
+    Rows are lists in the column order of CSV_HEADER. New rows are kept
+    until flush(), which appends them to the file in one go; after rows
+    were changed in place, mark them with changed() and flush() writes
+    the whole file instead.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.rows = []
+        self.by_asin = {}
+        self.by_file = {}
+        self.pending = []
+        self.rewrite = False
+        if os.path.isfile(filename):
+            with open(filename, 'rb') as f:
+                for row in csv_reader(f):
+                    self.rows.append(row)
+                    self.index(row)
+        else:
+            self.rows.append(list(CSV_HEADER))
+            self.pending.append(self.rows[0])
+
+    def index(self, row):
+        if len(row) < len(CSV_HEADER):
+            return
+        if row[0] != NO_ASIN:
+            self.by_asin[row[0]] = row
+        self.by_file[row[6]] = row
+
+    def find(self, asin, name):
+        """Row of the book with asin or, for books without one, name."""
+        if asin != NO_ASIN:
+            return self.by_asin.get(asin)
+        row = self.by_file.get(name)
+        if row is not None and row[0] == NO_ASIN:
+            return row
+        return None
+
+    def add(self, row):
+        """Add the row of a new book, unless its ASIN or file is known."""
+        if row[0] in self.by_asin or row[6] in self.by_file:
+            return False
+        print('* Uaktualnienie pliku CSV...')
+        self.rows.append(row)
+        self.pending.append(row)
+        self.index(row)
+        return True
+
+    def changed(self):
+        self.rewrite = True
+
+    def flush(self):
+        if self.rewrite:
+            with open(self.filename, 'wb') as f:
+                csv_writer(f).writerows(self.rows)
+        elif self.pending:
+            with open(self.filename, 'ab') as f:
+                csv_writer(f).writerows(self.pending)
+        self.pending = []
+        self.rewrite = False
@@ -8,39 +8,9 @@ import sys
 import struct
 import unicodedata
 
-SFENC = sys.getfilesystemencoding()
-
-
-class PalmDB:
-    unique_id_seed = 68
-    number_of_pdb_records = 76
-    first_pdb_record = 78
-
-    def __init__(self, palmdata):
-        self.data = palmdata
-        self.nsec, = struct.unpack_from('>H', self.data,
-                                        PalmDB.number_of_pdb_records)
-
-    def getsecaddr(self, secno):
-        secstart, = struct.unpack_from('>L', self.data,
-                                       PalmDB.first_pdb_record + secno * 8)
-        if secno == self.nsec - 1:
-            secend = len(self.data)
-        else:
-            secend, = struct.unpack_from(
-                '>L', self.data,
-                PalmDB.first_pdb_record + (secno + 1) * 8
-            )
-        return secstart, secend
-
-    def readsection(self, secno):
-        if secno < self.nsec:
-            secstart, secend = self.getsecaddr(secno)
-            return self.data[secstart:secend]
-        return ''
+from kindle_unpack import SeekSectionizer
 
-    def getnumsections(self):
-        return self.nsec
+SFENC = sys.getfilesystemencoding()
 
 
 def find_exth(search_id, content):
@@ -63,9 +33,7 @@ def strip_accents(text):
     ) if unicodedata.category(c) != 'Mn')
 
 
-def mobi_header_fields(mobi_content):
-    pp = PalmDB(mobi_content)
-    header = pp.readsection(0)
+def mobi_header_fields(header):
     id = struct.unpack_from('4s', header, 0x10)[0]
     version = struct.unpack_from('>L', header, 0x24)[0]
     dict_input = struct.unpack_from('>L', header, 0x60)[0]
@@ -79,20 +47,19 @@ def mobi_header_fields(mobi_content):
     return id, version, title, locations, dict_input, dict_output
 
 
-def get_pages(dirpath, mfile):
+def pages_row(section, mfile):
     file_dec = mfile.decode(sys.getfilesystemencoding())
-    with open(os.path.join(dirpath, mfile), 'rb') as f:
-        mobi_content = f.read()
-    if mobi_content[60:68] != 'BOOKMOBI':
+    if section is None or section.ident != 'BOOKMOBI':
         print(file_dec + ': nieprawidłowy format pliku. Pomijam...')
         return None
-    id, ver, title, locations, di, do = mobi_header_fields(mobi_content)
+    header = bytes(section.load_section(0))
+    id, ver, title, locations, di, do = mobi_header_fields(header)
     if (di != 0 or do != 0):
         print(file_dec)
         return None
-    author = find_exth(100, mobi_content)
-    asin = find_exth(113, mobi_content)
-    dc_lang = find_exth(524, mobi_content)
+    author = find_exth(100, header)
+    asin = find_exth(113, header)
+    dc_lang = find_exth(524, header)
     if '!DeviceUpgradeLetter!' in asin:
         print(file_dec + ': Wiadomość od Amazonu. Pomijam...')
         return None
@@ -106,3 +73,12 @@ def get_pages(dirpath, mfile):
         os.path.join(mfile)
     ]
     return row
+
+
+def get_pages(dirpath, mfile):
+    try:
+        section = SeekSectionizer(os.path.join(dirpath, mfile))
+    except struct.error:
+        return pages_row(None, mfile)
+    with section:
+        return pages_row(section, mfile)
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+#
+
+from collections import deque
+from multiprocessing.pool import ThreadPool
+
+READ_AHEAD_BYTES = 64 * 1024 * 1024
+
+_END = object()
+
+
+def read_ahead(items, load, depth=4, max_bytes=READ_AHEAD_BYTES,
+               size=None):
+    """
+    Yield (item, load(item)) pairs in order, loading upcoming items early.
+
+    Up to depth items are loaded by a small thread pool while the caller
+    works on the current one, so the device is kept busy while covers
+    are decoded. size(item) estimates the bytes a load keeps in memory
+    before it is started; a new load is only started while the estimates
+    of the started but not yet consumed loads stay under max_bytes. The
+    next item is always loaded, however large. With depth 0 items are
+    loaded one at a time in the calling thread.
+    """
+    if depth < 1:
+        for item in items:
+            yield item, load(item)
+        return
+    items = iter(items)
+    pending = deque()
+    in_flight = 0
+    pool = ThreadPool(depth)
+    try:
+        upcoming = next(items, _END)
+        while True:
+            while upcoming is not _END and len(pending) < depth:
+                estimate = size(upcoming) if size is not None else 0
+                if pending and in_flight + estimate > max_bytes:
+                    break
+                pending.append((upcoming, estimate,
+                                pool.apply_async(load, (upcoming,))))
+                in_flight += estimate
+                upcoming = next(items, _END)
+            if not pending:
+                break
+            item, estimate, async_result = pending.popleft()
+            in_flight -= estimate
+            yield item, async_result.get()
+    finally:
+        pool.terminate()
+        pool.join()
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+#
+
+from __future__ import print_function
+import hashlib
+import os
+import sqlite3
+import uuid
+
+DEVICE_ID_FILE = '.ect_device_id'
+FINGERPRINT_BLOCK = 65536
+# updates kept uncommitted at most, so a failed run loses little
+CHECKPOINT_UPDATES = 25
+
+
+def device_serial(kindlepath):
+    """
+    Return the identifier of the Kindle mounted at kindlepath.
+
+    The serial number is not exposed on the USB mass storage volume, so
+    a random identifier is stored in the system directory of the device
+    on first use. When it cannot be written, on a read-only mount for
+    example, the absolute mount path identifies the device instead.
+    """
+    id_path = os.path.join(kindlepath, 'system', DEVICE_ID_FILE)
+    try:
+        with open(id_path, 'rb') as f:
+            serial = f.read().strip()
+        if serial:
+            return serial
+    except IOError:
+        pass
+    serial = uuid.uuid4().hex
+    try:
+        with open(id_path, 'wb') as f:
+            f.write(serial)
+    except IOError:
+        return 'path:' + os.path.abspath(kindlepath)
+    return serial
+
+
+def fingerprint(path, size):
+    """Cheap content fingerprint: size plus the first and last 64 KiB."""
+    digest = hashlib.md5(str(size))
+    with open(path, 'rb') as f:
+        digest.update(f.read(FINGERPRINT_BLOCK))
+        if size > FINGERPRINT_BLOCK:
+            f.seek(max(FINGERPRINT_BLOCK, size - FINGERPRINT_BLOCK))
+            digest.update(f.read(FINGERPRINT_BLOCK))
+    return digest.hexdigest()
+
+
+class ScanIndex(object):
+    """
+    Persistent on-host index of the books found on a device.
+
+    Entries are keyed by device serial and path relative to the Kindle
+    root and remember size, mtime, a content fingerprint, the parsed
+    ASIN, document type and page count, and which outputs (thumbnail,
+    APNX, patch) were produced, so unchanged books can be skipped on the
+    next run.
+    """
+
+    OUTPUTS = ('thumbnail', 'apnx', 'patched')
+
+    def __init__(self, filename, kindlepath):
+        self.kindlepath = kindlepath
+        self.prefix = os.path.join(kindlepath, '')
+        self.device = device_serial(kindlepath)
+        self.conn = sqlite3.connect(filename)
+        self.conn.text_factory = str
+        self.uncommitted = 0
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS books ('
+            'device TEXT, path TEXT, size INTEGER, mtime INTEGER, '
+            'fingerprint TEXT, asin TEXT, doctype TEXT, pages INTEGER, '
+            'thumbnail INTEGER DEFAULT 0, apnx INTEGER DEFAULT 0, '
+            'patched INTEGER DEFAULT 0, PRIMARY KEY (device, path))'
+        )
+        self.entries = {}
+        for row in self.conn.execute(
+                'SELECT path, size, mtime, fingerprint, asin, doctype, '
+                'pages, thumbnail, apnx, patched FROM books '
+                'WHERE device = ?', (self.device,)):
+            self.entries[row[0]] = {
+                'size': row[1], 'mtime': row[2], 'fingerprint': row[3],
+                'asin': row[4], 'doctype': row[5], 'pages': row[6],
+                'thumbnail': row[7], 'apnx': row[8], 'patched': row[9],
+            }
+
+    def relpath(self, path):
+        # paths are built by joining onto kindlepath, so a prefix check
+        # saves the normalisation of os.path.relpath
+        if path.startswith(self.prefix) and '..' not in path:
+            rel = path[len(self.prefix):]
+        else:
+            rel = os.path.relpath(path, self.kindlepath)
+        return rel.replace(os.path.sep, '/')
+
+    def unchanged(self, path, st=None):
+        """
+        Return the stored entry for path if the book has not changed.
+
+        Size and mtime are compared first. If they differ but the size
+        does not, the fingerprint decides, because FAT volumes do not
+        report mtime reliably.
+        """
+        entry = self.entries.get(self.relpath(path))
+        if entry is None:
+            return None
+        if st is None:
+            try:
+                st = os.stat(path)
+            except OSError:
+                return None
+        if entry['size'] != st.st_size:
+            return None
+        if entry['mtime'] == int(st.st_mtime):
+            return entry
+        try:
+            if fingerprint(path, st.st_size) != entry['fingerprint']:
+                return None
+        except IOError:
+            return None
+        entry['mtime'] = int(st.st_mtime)
+        self.conn.execute(
+            'UPDATE books SET mtime = ? WHERE device = ? AND path = ?',
+            (entry['mtime'], self.device, self.relpath(path))
+        )
+        self.checkpoint()
+        return entry
+
+    def update(self, path, **fields):
+        """Record the current state of path together with parsed fields."""
+        rel = self.relpath(path)
+        entry = self.entries.get(rel)
+        try:
+            st = os.stat(path)
+            if (entry is not None and entry['size'] == st.st_size and
+                    entry['mtime'] == int(st.st_mtime)):
+                fp = entry['fingerprint']
+            else:
+                fp = fingerprint(path, st.st_size)
+        except (IOError, OSError):
+            return
+        if (entry is None or entry['size'] != st.st_size or
+                entry['fingerprint'] != fp):
+            # content changed, forget the outputs produced from it
+            entry = dict.fromkeys(('asin', 'doctype', 'pages'))
+            entry.update(dict.fromkeys(ScanIndex.OUTPUTS, 0))
+        entry.update(fields)
+        entry['size'] = st.st_size
+        entry['mtime'] = int(st.st_mtime)
+        entry['fingerprint'] = fp
+        self.entries[rel] = entry
+        self.conn.execute(
+            'INSERT OR REPLACE INTO books (device, path, size, mtime, '
+            'fingerprint, asin, doctype, pages, thumbnail, apnx, patched) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (self.device, rel, entry['size'], entry['mtime'],
+             entry['fingerprint'], entry['asin'], entry['doctype'],
+             entry['pages'], int(entry['thumbnail']), int(entry['apnx']),
+             int(entry['patched']))
+        )
+        self.checkpoint()
+
+    def checkpoint(self):
+        self.uncommitted += 1
+        if self.uncommitted >= CHECKPOINT_UPDATES:
+            self.conn.commit()
+            self.uncommitted = 0
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
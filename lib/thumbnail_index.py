@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+#
+
+import os
+
+THUMBNAIL_PREFIX = 'thumbnail_'
+THUMBNAIL_SUFFIX = '.jpg'
+PARTIAL_SUFFIX = '.partial'
+
+
+def thumbnail_name(asin, doctype, orientation='portrait'):
+    return '%s%s_%s_%s%s' % (THUMBNAIL_PREFIX, asin, doctype, orientation,
+                             THUMBNAIL_SUFFIX)
+
+
+def thumbnail_key(name):
+    """(ASIN, doctype, orientation) of a thumbnail file name or None."""
+    if not (name.startswith(THUMBNAIL_PREFIX) and
+            name.endswith(THUMBNAIL_SUFFIX)):
+        return None
+    parts = name[len(THUMBNAIL_PREFIX):-len(THUMBNAIL_SUFFIX)].rsplit('_', 2)
+    if len(parts) != 3:
+        return None
+    return tuple(parts)
+
+
+class ThumbnailIndex(object):
+    """
+    The thumbnails of one directory, listed once.
+
+    Maps the (ASIN, doctype, orientation) keys of the thumbnails found to
+    their file names and keeps the names of unfinished .partial files.
+    add() records the thumbnails written afterwards.
+    """
+
+    def __init__(self, thumb_dir):
+        self.thumb_dir = thumb_dir
+        self.files = {}
+        self.partial = []
+        try:
+            names = os.listdir(thumb_dir)
+        except OSError:
+            names = []
+        for name in names:
+            if name.lower().endswith(PARTIAL_SUFFIX):
+                self.partial.append(name)
+                continue
+            key = thumbnail_key(name)
+            if key is not None:
+                self.files[key] = name
+
+    def has(self, asin, doctype, orientation='portrait'):
+        return (asin, doctype, orientation) in self.files
+
+    def path(self, asin, doctype, orientation='portrait'):
+        return os.path.join(self.thumb_dir,
+                            thumbnail_name(asin, doctype, orientation))
+
+    def add(self, path):
+        name = os.path.basename(path)
+        key = thumbnail_key(name)
+        if key is not None:
+            self.files[key] = name
+
+    def paths(self, exclude_orientation=None):
+        """Sorted paths of the thumbnails, optionally without one kind."""
+        return [os.path.join(self.thumb_dir, name)
+                for key, name in sorted(self.files.items())
+                if key[2] != exclude_orientation]
+
+    def remove_partial(self):
+        """Delete the .partial files found, returning how many went."""
+        removed = 0
+        for name in self.partial:
+            try:
+                os.remove(os.path.join(self.thumb_dir, name))
+            except OSError:
+                continue
+            removed += 1
+        self.partial = []
+        return removed